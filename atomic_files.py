@@ -0,0 +1,34 @@
+from contextlib import contextmanager
+
+import os
+import threading
+
+
+# --------------------------------------- #
+# Atomic Files
+# --------------------------------------- #
+# Yields a temporary path next to path to write to, which then replaces path in one step so readers never see
+# a partial file. Without replace, an existing file is kept and FileExistsError is raised instead.
+@contextmanager
+def atomic_path(path: str, replace: bool = True):
+	temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+	try:
+		yield temporary_path
+
+		if replace:
+			os.replace(temporary_path, path)
+		else:
+			os.link(temporary_path, path)
+	finally:
+		if os.path.exists(temporary_path):
+			os.remove(temporary_path)
+
+def write_atomic(path: str, content: str, sync: bool = False):
+	with atomic_path(path) as temporary_path:
+		with open(temporary_path, 'w') as file:
+			file.write(content)
+
+			if sync:
+				file.flush()
+				os.fsync(file.fileno())
@@ -0,0 +1,185 @@
+from collections import OrderedDict
+
+import threading
+import time
+
+import os
+import json
+import hashlib
+
+from atomic_files import atomic_path
+
+
+# --------------------------------------- #
+# LRU Cache
+# --------------------------------------- #
+class LRUCache:
+	# Without keep_evicted, persisted entries are removed together with the ones evicted from memory,
+	# which keeps the files on disk bounded by max_entries
+	def __init__(self, max_entries: int = 256, persist_folder: str | None = None, keep_evicted: bool = True):
+		self.max_entries = max_entries
+		self.persist_folder = persist_folder
+		self.keep_evicted = keep_evicted
+
+		self.hits = 0
+		self.misses = 0
+
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+		self.set_persist_folder(persist_folder)
+
+	def set_persist_folder(self, persist_folder: str | None):
+		self.persist_folder = persist_folder
+
+		if self.persist_folder:
+			os.makedirs(self.persist_folder, exist_ok=True)
+
+	# Persisted entries are named after the first part of a tuple key,
+	# so a newer version of an entry replaces the stale one on disk
+	def _get_persist_path(self, key) -> str:
+		name = hashlib.sha256(repr(key[0] if isinstance(key, tuple) else key).encode()).hexdigest()
+		return os.path.join(self.persist_folder, name + '.json')
+
+	def _load_persisted(self, key):
+		try:
+			with open(self._get_persist_path(key), 'r') as file:
+				entry = json.load(file)
+		except (FileNotFoundError, ValueError):
+			return None
+
+		if entry['key'] != repr(key):
+			return None
+
+		return entry['value']
+
+	def _save_persisted(self, key, value):
+		with atomic_path(self._get_persist_path(key)) as temporary_path:
+			with open(temporary_path, 'w') as file:
+				json.dump({'key': repr(key), 'value': value}, file)
+
+	def _remove_persisted(self, key):
+		try:
+			os.remove(self._get_persist_path(key))
+		except FileNotFoundError:
+			pass
+
+	def get(self, key, default=None):
+		with self._lock:
+			try:
+				value = self._entries[key]
+			except KeyError:
+				pass
+			else:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return value
+
+		if self.persist_folder:
+			value = self._load_persisted(key)
+			if value is not None:
+				self._store(key, value)
+
+				with self._lock:
+					self.hits += 1
+
+				return value
+
+		with self._lock:
+			self.misses += 1
+
+		return default
+
+	def _store(self, key, value):
+		evicted = []
+
+		with self._lock:
+			self._entries[key] = value
+			self._entries.move_to_end(key)
+
+			while len(self._entries) > self.max_entries:
+				evicted.append(self._entries.popitem(last=False)[0])
+
+		if self.persist_folder and not self.keep_evicted:
+			for evicted_key in evicted:
+				self._remove_persisted(evicted_key)
+
+	def set(self, key, value):
+		self._store(key, value)
+
+		if self.persist_folder:
+			self._save_persisted(key, value)
+
+	def delete(self, key):
+		with self._lock:
+			self._entries.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				'entries': len(self._entries),
+				'max_entries': self.max_entries,
+				'hits': self.hits,
+				'misses': self.misses
+			}
+
+
+# --------------------------------------- #
+# TTL Cache
+# --------------------------------------- #
+class TTLCache:
+	def __init__(self, ttl: float, max_entries: int = 4096):
+		self.ttl = ttl
+		self.max_entries = max_entries
+
+		self.hits = 0
+		self.misses = 0
+
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, default=None):
+		with self._lock:
+			try:
+				expires_at, value = self._entries[key]
+			except KeyError:
+				self.misses += 1
+				return default
+
+			if expires_at < time.monotonic():
+				del self._entries[key]
+				self.misses += 1
+				return default
+
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def set(self, key, value):
+		with self._lock:
+			self._entries[key] = (time.monotonic() + self.ttl, value)
+			self._entries.move_to_end(key)
+
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def delete(self, key):
+		with self._lock:
+			self._entries.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				'entries': len(self._entries),
+				'max_entries': self.max_entries,
+				'hits': self.hits,
+				'misses': self.misses
+			}
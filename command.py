@@ -22,6 +22,22 @@ ACTIONS = [
 	[
 		'start',
 		'Starts the server in either dev (for testing) or pro (for production)'
+	],
+	[
+		'migrate',
+		'Upgrades the database, re-renders outdated posts, rebuilds the search index, moves uploads into blob storage and resizes images'
+	],
+	[
+		'gc',
+		'Deletes uploaded files that are no longer referenced'
+	],
+	[
+		'import',
+		'Imports posts from a tarball of markdown files or a file with one json post per line, usage: nqh import <file>'
+	],
+	[
+		'rotate',
+		'Generates a new secret key for signing sessions, restart the server afterwards to use it'
 	]
 ]
 
@@ -84,13 +100,74 @@ def action_start() -> None:
 		case 'dev':
 			created_server = create_server(current_working_directory)
 			created_server.run(port=8000)
+		case 'pro':
+			from production import ProductionServer
+
+			ProductionServer(current_working_directory).run()
 		case _:
 			logger.error(f'Invalid environment: \'{environment}\'')
 
+def action_migrate() -> None:
+	from server import create_server, migrate_posts, rebuild_search_index, migrate_files, create_missing_derivatives
+
+	created_server = create_server(current_working_directory)
+
+	with created_server.app_context():
+		rerendered = migrate_posts(created_server)
+		indexed = rebuild_search_index(created_server)
+		migrated = migrate_files(created_server)
+		created = create_missing_derivatives(created_server)
+
+	logger.notice(f'Re-rendered {rerendered} post(s)')
+	logger.notice(f'Indexed {indexed} post(s) for search')
+	logger.notice(f'Moved {migrated} uploaded file(s) into blob storage')
+	logger.notice(f'Created {created} resized image(s)')
+
+def action_gc() -> None:
+	from server import create_server, collect_garbage
+
+	created_server = create_server(current_working_directory)
 
-match action_name:
-	case 'help': action_help()
-	case 'new': action_new()
-	case 'start': action_start()
-	case _:
-		logger.error(f'Invalid action: \'{action_name}\'')
+	with created_server.app_context():
+		removed = collect_garbage(created_server)
+
+	logger.notice(f'Removed {removed} unused file(s)')
+
+def action_import() -> None:
+	try:
+		import_path = os.path.join(current_working_directory, arguments[2])
+	except IndexError:
+		logger.error('Missing file to import')
+
+	from server import create_server, import_posts, read_tar_posts, read_ndjson_posts
+	import tarfile
+
+	created_server = create_server(current_working_directory)
+
+	with open(import_path, 'rb') as file, created_server.app_context():
+		posts = read_tar_posts(file) if tarfile.is_tarfile(import_path) else read_ndjson_posts(file)
+
+		for progress in import_posts(created_server, posts):
+			logger.notice(f'Imported {progress['imported']} post(s), skipped {progress['skipped']}, {progress['posts_per_second']} posts/s')
+
+def action_rotate() -> None:
+	from server import get_secret_keys_path, rotate_secret_keys
+
+	secret_keys_path = get_secret_keys_path(current_working_directory)
+	secret_keys = rotate_secret_keys(secret_keys_path)
+
+	logger.notice(f'Generated a new secret key in \'{secret_keys_path}\', {len(secret_keys) - 1} old key(s) are still accepted')
+
+
+# The post import's render processes import this file again, they must not run the action a second time
+if __name__ == '__main__':
+	match action_name:
+		case 'help': action_help()
+		case 'new': action_new()
+		case 'start': action_start()
+		case 'migrate': action_migrate()
+		case 'gc': action_gc()
+		case 'import': action_import()
+		case 'rotate': action_rotate()
+		case _:
+			logger.error(f'Invalid action: \'{action_name}\'')
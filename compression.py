@@ -0,0 +1,79 @@
+import gzip
+import zlib
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+from load_config import Config
+
+
+COMPRESSIBLE_MIMETYPES = frozenset((
+	'text/html',
+	'text/css',
+	'text/plain',
+	'text/markdown',
+	'application/json',
+	'application/x-ndjson',
+	'application/javascript'
+))
+
+COMPRESSIBLE_EXTENSIONS = frozenset(('html', 'css', 'txt', 'md', 'json', 'js', 'svg'))
+
+# Preferred first
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+ENCODING_EXTENSIONS = {
+	'br': '.br',
+	'gzip': '.gz'
+}
+
+
+def compress(data: bytes, encoding: str, config: Config) -> bytes:
+	match encoding:
+		case 'br':
+			return brotli.compress(data, quality=config.compression_brotli_quality)
+		case 'gzip':
+			return gzip.compress(data, compresslevel=config.compression_gzip_level, mtime=0)
+
+	raise ValueError(f'Unsupported encoding: \'{encoding}\'')
+
+# Compresses chunks as they come, so a streamed response doesn't have to be held in memory
+def compress_stream(chunks, encoding: str, config: Config):
+	match encoding:
+		case 'br':
+			compressor = brotli.Compressor(quality=config.compression_brotli_quality)
+			compress_chunk, finish = compressor.process, compressor.finish
+		case 'gzip':
+			compressor = zlib.compressobj(config.compression_gzip_level, wbits=31)
+			compress_chunk, finish = compressor.compress, compressor.flush
+		case _:
+			raise ValueError(f'Unsupported encoding: \'{encoding}\'')
+
+	for chunk in chunks:
+		data = compress_chunk(chunk.encode() if isinstance(chunk, str) else chunk)
+
+		if data:
+			yield data
+
+	yield finish()
+
+def negotiate_encoding(accept_encodings) -> str | None:
+	for encoding in ENCODINGS:
+		if accept_encodings[encoding] > 0:
+			return encoding
+
+	return None
+
+def is_compressible_file(path: str) -> bool:
+	return '.' in path and path.rsplit('.', 1)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+# Writes <path>.gz and <path>.br next to a file so a front proxy can serve them directly
+def write_compressed_siblings(path: str, config: Config) -> None:
+	with open(path, 'rb') as file:
+		data = file.read()
+
+	for encoding in ENCODINGS:
+		with open(path + ENCODING_EXTENSIONS[encoding], 'wb') as file:
+			file.write(compress(data, encoding, config))
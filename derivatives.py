@@ -0,0 +1,120 @@
+try:
+	from PIL import Image, ImageOps
+except ImportError:
+	Image = None
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from load_config import Config
+from atomic_files import atomic_path
+import logger
+
+
+DERIVATIVES_FOLDER = 'derivatives'
+
+# Bump whenever resizing changes, derivatives are then created again in a new folder and the old ones collected
+DERIVATIVES_VERSION = 2
+
+IMAGE_FORMATS = {
+	'png': 'PNG',
+	'jpg': 'JPEG',
+	'jpeg': 'JPEG',
+	'gif': 'GIF'
+}
+
+
+# --------------------------------------- #
+# Paths
+# --------------------------------------- #
+def get_extension(filename: str) -> str:
+	return filename.rsplit('.', 1)[-1].lower()
+
+def is_image(filename: str) -> bool:
+	return Image is not None and get_extension(filename) in IMAGE_FORMATS
+
+def get_derivatives_folder() -> str:
+	return os.path.join(DERIVATIVES_FOLDER, f'v{DERIVATIVES_VERSION}')
+
+def get_derivative_link(content_hash: str, width: int, extension: str) -> str:
+	return os.path.join(get_derivatives_folder(), content_hash[0:2], content_hash[2:4], f'{content_hash}-{width}.{extension}')
+
+def get_derivative_width(requested_width: int, config: Config) -> int | None:
+	for width in sorted(config.image_derivatives_widths):
+		if width >= requested_width:
+			return width
+
+	return None
+
+
+# --------------------------------------- #
+# Generation
+# --------------------------------------- #
+def create_derivatives(upload_folder: str, content_link: str, content_hash: str, extension: str, config: Config) -> int:
+	created = 0
+
+	with Image.open(os.path.join(upload_folder, content_link)) as original_image:
+		# Resizing would only keep the first frame
+		if getattr(original_image, 'is_animated', False):
+			return 0
+
+		# Derivatives are saved without the exif orientation, so it is applied to the pixels instead
+		image = ImageOps.exif_transpose(original_image)
+
+		for width in config.image_derivatives_widths:
+			if width >= image.width:
+				continue
+
+			derivative_path = os.path.join(upload_folder, get_derivative_link(content_hash, width, extension))
+
+			if os.path.exists(derivative_path):
+				continue
+
+			os.makedirs(os.path.dirname(derivative_path), exist_ok=True)
+
+			derivative = image.copy()
+			derivative.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+
+			image_format = IMAGE_FORMATS[extension]
+
+			with atomic_path(derivative_path) as temporary_path:
+				if image_format == 'JPEG':
+					derivative.convert('RGB').save(temporary_path, image_format, quality=config.image_derivatives_jpeg_quality, optimize=True, progressive=True)
+				else:
+					derivative.save(temporary_path, image_format, optimize=True)
+
+			created += 1
+
+	return created
+
+
+class DerivativeGenerator:
+	def __init__(self, config: Config):
+		self.config = config
+
+		self._executor = None
+		self._executor_pid = None
+		self._lock = threading.Lock()
+
+	# Created lazily so every worker process gets its own threads
+	def _get_executor(self) -> ThreadPoolExecutor:
+		with self._lock:
+			if self._executor_pid != os.getpid():
+				self._executor = ThreadPoolExecutor(max_workers=self.config.image_derivatives_workers, thread_name_prefix='derivatives')
+				self._executor_pid = os.getpid()
+
+			return self._executor
+
+	def submit(self, upload_folder: str, content_link: str, content_hash: str, filename: str):
+		if not self.config.image_derivatives_enabled or not is_image(filename):
+			return None
+
+		future = self._get_executor().submit(create_derivatives, upload_folder, content_link, content_hash, get_extension(filename), self.config)
+		future.add_done_callback(lambda future: self._report_failure(future, filename))
+
+		return future
+
+	def _report_failure(self, future, filename: str):
+		if future.exception() is not None:
+			logger.notice(f'Could not create derivatives for \'{filename}\': {future.exception()}')
@@ -0,0 +1,18 @@
+from load_config import Config
+import rendering
+
+
+# --------------------------------------- #
+# Worker
+# --------------------------------------- #
+# Runs in the post import's render processes, which only import this module instead of the whole server
+config = None
+
+def load_config(config_path: str):
+	global config
+
+	config = Config()
+	config.load(config_path)
+
+def render_post(content: str) -> str:
+	return rendering.render_markdown(content, config)
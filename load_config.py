@@ -1,4 +1,10 @@
 import tomli
+import bleach
+
+import json
+import hashlib
+import threading
+from types import MappingProxyType
 
 class Config:
 	def load(self, config_file: str):
@@ -8,6 +14,8 @@ class Config:
 		self.site_name = site_config['site_name']
 		self.footnote = site_config['footnote']
 
+		self.posts_per_page = site_config['posts_per_page']
+
 		self.site_colors = site_config['site_colors']
 
 		self.site_color_background = self.site_colors['background']
@@ -28,6 +36,12 @@ class Config:
 		self.site_color_disabled = self.site_colors['disabled']
 
 		self.roles = site_config['roles']
+		self.role_permissions = MappingProxyType({
+			role_name: frozenset(role['permissions']) for role_name, role in self.roles.items()
+		})
+		self.role_max_upload_sizes = MappingProxyType({
+			role_name: role['max_upload_size'] for role_name, role in self.roles.items()
+		})
 
 		self.allowed_clean = site_config['allowed_clean']
 
@@ -37,10 +51,105 @@ class Config:
 		self.allowed_clean_letters = self.allowed_clean['letters']
 		self.allowed_clean_characters = self.allowed_clean['characters']
 
-		self.allowed_file_extensions = self.allowed_clean['allowed_file_extensions']
+		self.allowed_clean_letters_set = frozenset(self.allowed_clean_letters)
+		self.allowed_clean_characters_set = frozenset(self.allowed_clean_characters)
 
-		self.link_badges_dict = site_config['link_badges']
-		self.link_badges = []
+		self.allowed_file_extensions = frozenset(self.allowed_clean['allowed_file_extensions'])
+
+		self.allowed_clean_html_fingerprint = hashlib.sha256(
+			json.dumps([self.allowed_clean_html_tags, self.allowed_clean_html_attributes], sort_keys=True).encode()
+		).hexdigest()[0:16]
+
+		self._html_cleaners = threading.local()
+
+		self.post_cache = site_config['post_cache']
+
+		self.post_cache_max_entries = self.post_cache['max_entries']
+		self.post_cache_persist = self.post_cache['persist']
+
+		self.page_cache = site_config['page_cache']
+
+		self.page_cache_enabled = self.page_cache['enabled']
+		self.page_cache_max_entries = self.page_cache['max_entries']
+		self.page_cache_persist = self.page_cache['persist']
+		self.page_cache_like_staleness = self.page_cache['like_staleness']
+
+		self.database = site_config['database']
+
+		self.database_journal_mode = self.database['journal_mode']
+		self.database_synchronous = self.database['synchronous']
+		self.database_mmap_size = self.database['mmap_size']
+		self.database_cache_size = self.database['cache_size']
+		self.database_busy_timeout = self.database['busy_timeout']
+
+		self.database_pool_size = self.database['pool_size']
+		self.database_max_overflow = self.database['max_overflow']
+		self.database_pool_timeout = self.database['pool_timeout']
+
+		self.file_storage = site_config['file_storage']
+
+		self.file_storage_offload = self.file_storage['offload']
+		self.file_storage_offload_prefix = self.file_storage['offload_prefix']
+		self.file_storage_cache_ttl = self.file_storage['cache_ttl']
+		self.file_storage_cache_max_entries = self.file_storage['cache_max_entries']
+
+		self.image_derivatives = site_config['image_derivatives']
+
+		self.image_derivatives_enabled = self.image_derivatives['enabled']
+		self.image_derivatives_widths = tuple(self.image_derivatives['widths'])
+		self.image_derivatives_jpeg_quality = self.image_derivatives['jpeg_quality']
+		self.image_derivatives_workers = self.image_derivatives['workers']
 
-		for badge_key in self.link_badges_dict.keys():
-			self.link_badges.append(self.link_badges_dict[badge_key])
+		self.compression = site_config['compression']
+
+		self.compression_gzip_level = self.compression['gzip_level']
+		self.compression_brotli_quality = self.compression['brotli_quality']
+		self.compression_min_size = self.compression['min_size']
+		self.compression_cache_max_entries = self.compression['cache_max_entries']
+
+		self.api_keys = site_config['api_keys']
+
+		self.api_keys_cache_ttl = self.api_keys['cache_ttl']
+		self.api_keys_negative_cache_ttl = self.api_keys['negative_cache_ttl']
+		self.api_keys_cache_max_entries = self.api_keys['cache_max_entries']
+
+		self.likes = site_config['likes']
+
+		self.likes_buffered = self.likes['buffered']
+		self.likes_flush_interval = self.likes['flush_interval']
+
+		self.export = site_config['export']
+
+		self.export_workers = self.export['workers']
+
+		self.post_import = site_config['post_import']
+
+		self.post_import_batch_size = self.post_import['batch_size']
+		self.post_import_workers = self.post_import['workers']
+		self.post_import_max_size = self.post_import['max_size']
+
+		self.sessions = site_config['sessions']
+
+		self.sessions_secret_keys_path = self.sessions['secret_keys_path']
+		self.sessions_old_secret_keys = self.sessions['old_secret_keys']
+
+		self.production = site_config['production']
+
+		self.production_bind = self.production['bind']
+		self.production_workers = self.production['workers']
+		self.production_threads = self.production['threads']
+		self.production_keepalive = self.production['keepalive']
+		self.production_timeout = self.production['timeout']
+		self.production_graceful_timeout = self.production['graceful_timeout']
+		self.production_max_requests = self.production['max_requests']
+
+		self.link_badges_dict = site_config['link_badges']
+		self.link_badges = tuple(self.link_badges_dict.values())
+
+	# bleach cleaners aren't thread safe, so each thread builds its own once
+	def get_html_cleaner(self) -> bleach.Cleaner:
+		try:
+			return self._html_cleaners.cleaner
+		except AttributeError:
+			self._html_cleaners.cleaner = bleach.Cleaner(tags=self.allowed_clean_html_tags, attributes=self.allowed_clean_html_attributes)
+			return self._html_cleaners.cleaner
@@ -0,0 +1,61 @@
+from gunicorn.app.base import BaseApplication
+
+import os
+
+from load_config import Config
+
+
+CONFIG_PATH = 'configuration.toml'
+
+
+# --------------------------------------- #
+# Hooks
+# --------------------------------------- #
+# SQLite connections must not be shared with a forked child, so every worker opens its own
+def post_fork(arbiter, worker):
+	from server import database
+
+	with arbiter.app.wsgi().app_context():
+		database.engine.dispose(close=False)
+
+
+# --------------------------------------- #
+# Server
+# --------------------------------------- #
+class ProductionServer(BaseApplication):
+	def __init__(self, work_path: str, options: dict | None = None):
+		self.work_path = work_path
+		self.options = options or {}
+
+		super().__init__()
+
+	# Runs again on SIGHUP, which also replaces the workers once they finished their requests. The preloaded app
+	# is kept though, so only the options below change without a full restart
+	def load_config(self):
+		config = Config()
+		config.load(CONFIG_PATH)
+
+		options = {
+			'bind': config.production_bind,
+			'workers': config.production_workers or os.cpu_count(),
+			'worker_class': 'gthread',
+			'threads': config.production_threads,
+			'keepalive': config.production_keepalive,
+			'timeout': config.production_timeout,
+			'graceful_timeout': config.production_graceful_timeout,
+			'max_requests': config.production_max_requests,
+			'max_requests_jitter': config.production_max_requests // 10,
+
+			# The database is created and upgraded once in the master instead of by every worker at the same
+			# time, the workers also share the master's memory
+			'preload_app': True,
+			'post_fork': post_fork
+		}
+
+		for name, value in (options | self.options).items():
+			self.cfg.set(name, value)
+
+	def load(self):
+		from server import create_server
+
+		return create_server(self.work_path)
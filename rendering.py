@@ -0,0 +1,158 @@
+from jinja2 import FileSystemBytecodeCache
+from markdown import markdown
+
+import os
+import hashlib
+import threading
+
+from load_config import Config
+from atomic_files import write_atomic
+
+
+# Bump whenever the markdown -> html pipeline changes so stored artifacts get re-rendered
+RENDER_VERSION = 1
+
+
+# --------------------------------------- #
+# Site
+# --------------------------------------- #
+# Changes whenever the config, a template or the render pipeline changes
+def get_site_hash(templates_folder: str, config_path: str) -> str:
+	site_hash = hashlib.sha256()
+
+	with open(config_path, 'rb') as file:
+		site_hash.update(file.read())
+
+	for folder, _, files in sorted(os.walk(templates_folder)):
+		for name in sorted(files):
+			path = os.path.join(folder, name)
+
+			site_hash.update(os.path.relpath(path, templates_folder).encode())
+			with open(path, 'rb') as file:
+				site_hash.update(file.read())
+
+	site_hash.update(str(RENDER_VERSION).encode())
+
+	return site_hash.hexdigest()
+
+
+# --------------------------------------- #
+# Templates
+# --------------------------------------- #
+# Compiled templates are shared through the cache folder, so only the first process to load one compiles it
+def set_template_cache(environment, cache_folder: str) -> None:
+	os.makedirs(cache_folder, exist_ok=True)
+	environment.bytecode_cache = FileSystemBytecodeCache(cache_folder)
+
+# Loads every template up front instead of on the first request that needs it
+def load_templates(environment) -> int:
+	template_names = environment.list_templates()
+
+	for name in template_names:
+		environment.get_template(name)
+
+	return len(template_names)
+
+
+# --------------------------------------- #
+# Stylesheet
+# --------------------------------------- #
+def render_stylesheet(environment, config: Config) -> str:
+	return environment.get_template('main.css').render(
+		colorBackground = config.site_color_background,
+		colorBackgroundAccent = config.site_color_background_accent,
+
+		colorText = config.site_color_text,
+		colorTextLight = config.site_color_text_light,
+
+		colorAccent = config.site_color_accent,
+		colorAccentHover = config.site_color_accent_hover,
+
+		colorAccentText = config.site_color_accent_text,
+
+		colorCode = config.site_color_code,
+
+		colorPreformatted = config.site_color_preformatted,
+
+		colorDisabled = config.site_color_disabled
+	)
+
+def get_stylesheet_name(stylesheet: str) -> str:
+	return f'main.{get_content_hash(stylesheet)[0:12]}.css'
+
+
+# --------------------------------------- #
+# Posts
+# --------------------------------------- #
+def render_markdown(content: str, config: Config) -> str:
+	content = markdown(content)
+	return config.get_html_cleaner().clean(content)
+
+def get_artifact_path(posts_folder: str, content_link: str) -> str:
+	return os.path.join(posts_folder, content_link + '.html')
+
+def is_artifact_current(render_version: int, render_fingerprint: str, config: Config) -> bool:
+	return render_version == RENDER_VERSION and render_fingerprint == config.allowed_clean_html_fingerprint
+
+# The markdown source was edited after the artifact was written (or the artifact is missing)
+def is_artifact_stale(posts_folder: str, content_link: str) -> bool:
+	try:
+		artifact_mtime = os.stat(get_artifact_path(posts_folder, content_link)).st_mtime_ns
+	except FileNotFoundError:
+		return True
+
+	return os.stat(os.path.join(posts_folder, content_link)).st_mtime_ns > artifact_mtime
+
+def get_content_hash(content: str) -> str:
+	return hashlib.sha256(content.encode()).hexdigest()[0:32]
+
+def write_artifact(posts_folder: str, content_link: str, config: Config) -> str:
+	with open(os.path.join(posts_folder, content_link), 'r') as file:
+		content = render_markdown(file.read(), config)
+
+	return save_artifact(posts_folder, content_link, content)
+
+def save_artifact(posts_folder: str, content_link: str, content: str, sync: bool = False) -> str:
+	write_atomic(get_artifact_path(posts_folder, content_link), content, sync=sync)
+
+	return content
+
+
+# --------------------------------------- #
+# Pages
+# --------------------------------------- #
+# Markdown files written by the site's operator, so they aren't cleaned like posts
+def render_page(path: str) -> str:
+	with open(path, 'r') as file:
+		return markdown(file.read())
+
+def get_page_names(pages_folder: str) -> list[str]:
+	try:
+		return sorted(name.removesuffix('.md') for name in os.listdir(pages_folder) if name.endswith('.md'))
+	except FileNotFoundError:
+		return []
+
+def get_page_title(name: str) -> str:
+	return name.replace('-', ' ').replace('_', ' ').title()
+
+# Rendered pages kept in memory, a page is rendered again once its file changes
+class MarkdownPages:
+	def __init__(self):
+		self._pages = {}
+		self._lock = threading.Lock()
+
+	def get(self, path: str) -> str:
+		mtime = os.stat(path).st_mtime_ns
+
+		with self._lock:
+			page = self._pages.get(path)
+
+		if page is not None and page[0] == mtime:
+			return page[1]
+
+		content = render_page(path)
+
+		with self._lock:
+			self._pages[path] = (mtime, content)
+
+		return content
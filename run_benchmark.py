@@ -0,0 +1,311 @@
+import os
+import sys
+import shutil
+import subprocess
+import time
+import random
+import socket
+import tempfile
+import threading
+import http.client
+import multiprocessing
+
+import logger
+
+
+# --------------------------------------- #
+# Helpers
+# --------------------------------------- #
+def run_threads(thread_count: int, operation_count: int, operation) -> tuple[float, int]:
+	errors = []
+
+	def worker():
+		for _ in range(operation_count):
+			try:
+				operation()
+			except Exception as exception:
+				errors.append(exception)
+
+	threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+
+	start_time = time.perf_counter()
+
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	elapsed_time = time.perf_counter() - start_time
+
+	return (thread_count * operation_count) / elapsed_time, len(errors)
+
+
+# --------------------------------------- #
+# Benchmark: Database
+# --------------------------------------- #
+DATABASE_PROFILES = {
+	'sqlite defaults': {
+		'database_journal_mode': 'DELETE',
+		'database_synchronous': 'FULL',
+		'database_mmap_size': 0,
+		'database_cache_size': -2000,
+		'database_busy_timeout': 0
+	},
+	'configuration.toml': {}
+}
+
+def benchmark_database(thread_count: int = 8, operation_count: int = 200) -> None:
+	import server
+
+	original_values = {name: getattr(server.config, name) for name in DATABASE_PROFILES['sqlite defaults'].keys()}
+
+	for profile_name, profile in DATABASE_PROFILES.items():
+		for name, value in (original_values | profile).items():
+			setattr(server.config, name, value)
+
+		created_server = server.create_server(tempfile.mkdtemp())
+		created_server.logger.disabled = True
+
+		with created_server.app_context():
+			post_ids = []
+
+			for index in range(20):
+				title = f'benchmark post {chr(ord("a") + index)}'
+				server.create_post(created_server, title, content=f'# {title}')
+				post_ids.append(server.get_cleaned_string(title, allowed_characters=server.config.allowed_clean_letters_set, separator='-', all_lower=True))
+
+		client = created_server.test_client()
+
+		def operation():
+			post_id = random.choice(post_ids)
+
+			if random.random() < 0.5:
+				response = client.get(f'/api/v0/posts/{post_id}/like')
+			else:
+				response = client.get(f'/api/v0/posts/{post_id}')
+
+			if response.status_code != 200:
+				raise RuntimeError(response.status_code)
+
+		operations_per_second, errors = run_threads(thread_count, operation_count, operation)
+
+		print(f'{profile_name:>24}: {operations_per_second:10.1f} requests/s, {errors} failed')
+
+		with created_server.app_context():
+			server.database.engine.dispose()
+
+	for name, value in original_values.items():
+		setattr(server.config, name, value)
+
+
+# --------------------------------------- #
+# Benchmark: Cleaning
+# --------------------------------------- #
+# The original character by character implementation, kept to check the new one against
+def get_cleaned_string_reference(name: str, allowed_characters, separator=' ', all_lower=False):
+	if all_lower:
+		name = name.lower()
+	name = name.replace('  ', '')
+
+	final = ''
+
+	for letter in name:
+		if letter in allowed_characters:
+			final += letter
+		elif letter == ' ':
+			final += separator
+
+	return final
+
+def benchmark_cleaning(check_count: int = 20000, payload_size: int = 200000) -> None:
+	import server
+
+	alphabet = server.config.allowed_clean_characters + '  -_.,;<>[]^\\\n\téßüЖ中🙂'
+
+	for _ in range(check_count):
+		name = ''.join(random.choices(alphabet, k=random.randint(0, 40)))
+
+		for allowed_characters, separator, all_lower in (
+			(server.config.allowed_clean_characters_set, ' ', False),
+			(server.config.allowed_clean_letters_set, '-', True)
+		):
+			expected = get_cleaned_string_reference(name, allowed_characters, separator, all_lower)
+			actual = server.get_cleaned_string(name, allowed_characters=allowed_characters, separator=separator, all_lower=all_lower)
+
+			if expected != actual:
+				logger.error(f'Output differs for {name!r}: {expected!r} != {actual!r}')
+
+	print(f'{check_count * 2} random inputs cleaned identically')
+
+	payload = ''.join(random.choices(alphabet, k=payload_size))
+
+	for implementation_name, implementation in (
+		('reference', lambda: get_cleaned_string_reference(payload, server.config.allowed_clean_characters_set)),
+		('get_cleaned_string', lambda: server.get_cleaned_string(payload))
+	):
+		start_time = time.perf_counter()
+		implementation()
+		elapsed_time = time.perf_counter() - start_time
+
+		print(f'{implementation_name:>24}: {elapsed_time * 1000:10.2f} ms for {payload_size} characters')
+
+
+# --------------------------------------- #
+# Benchmark: Production
+# --------------------------------------- #
+def run_production_server(work_path: str, options: dict) -> None:
+	from production import ProductionServer
+
+	ProductionServer(work_path, options).run()
+
+def get_free_port() -> int:
+	with socket.socket() as listener:
+		listener.bind(('127.0.0.1', 0))
+		return listener.getsockname()[1]
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+	deadline = time.monotonic() + timeout
+
+	while time.monotonic() < deadline:
+		try:
+			socket.create_connection(('127.0.0.1', port), timeout=1).close()
+			return
+		except OSError:
+			time.sleep(0.1)
+
+	logger.error(f'Server on port {port} did not start')
+
+# Requests per second against 'nqh start pro' with 1, 2, 4, ... workers, up to one per cpu core
+def benchmark_production(thread_count: int = 32, operation_count: int = 100) -> None:
+	import server
+
+	work_path = tempfile.mkdtemp()
+
+	created_server = server.create_server(work_path)
+
+	with created_server.app_context():
+		post_ids = []
+
+		for index in range(20):
+			title = f'benchmark post {chr(ord("a") + index)}'
+			server.create_post(created_server, title, content=f'# {title}\n\n' + 'Lorem ipsum dolor sit amet. ' * 50)
+			post_ids.append(server.get_cleaned_string(title, allowed_characters=server.config.allowed_clean_letters_set, separator='-', all_lower=True))
+
+		server.database.engine.dispose()
+
+	cpu_count = os.cpu_count()
+	worker_counts = sorted({2 ** power for power in range(cpu_count.bit_length()) if 2 ** power <= cpu_count} | {cpu_count})
+
+	base_requests_per_second = None
+
+	for worker_count in worker_counts:
+		port = get_free_port()
+
+		process = multiprocessing.Process(target=run_production_server, args=(work_path, {
+			'bind': f'127.0.0.1:{port}',
+			'workers': worker_count,
+			'loglevel': 'warning'
+		}))
+		process.start()
+
+		wait_for_port(port)
+
+		# One keep-alive connection per client thread
+		connections = threading.local()
+
+		def operation():
+			if not hasattr(connections, 'connection'):
+				connections.connection = http.client.HTTPConnection('127.0.0.1', port)
+
+			connections.connection.request('GET', f'/posts/{random.choice(post_ids)}')
+
+			response = connections.connection.getresponse()
+			response.read()
+
+			if response.status != 200:
+				raise RuntimeError(response.status)
+
+		requests_per_second, errors = run_threads(thread_count, operation_count, operation)
+
+		process.terminate()
+		process.join()
+
+		base_requests_per_second = base_requests_per_second or requests_per_second
+
+		print(f'{worker_count:>3} worker(s): {requests_per_second:10.1f} requests/s ({requests_per_second / base_requests_per_second:.2f}x), {errors} failed')
+
+
+# --------------------------------------- #
+# Benchmark: Startup
+# --------------------------------------- #
+# Runs in a new process each time, like a freshly started worker
+STARTUP_SCRIPT = '''
+import sys
+import time
+
+start_time = time.perf_counter()
+
+import server
+server.config.page_cache_enabled = False
+
+created_server = server.create_server(sys.argv[1])
+startup_time = time.perf_counter() - start_time
+
+client = created_server.test_client()
+request_times = []
+
+for _ in range(2):
+	start_time = time.perf_counter()
+	client.get('/posts/benchmark-post')
+	request_times.append(time.perf_counter() - start_time)
+
+print(startup_time, *request_times)
+'''
+
+def benchmark_startup(run_count: int = 5) -> None:
+	import server
+
+	work_path = tempfile.mkdtemp()
+
+	created_server = server.create_server(work_path)
+
+	with created_server.app_context():
+		server.create_post(created_server, 'benchmark post', content='# benchmark post')
+		server.database.engine.dispose()
+
+	template_cache_folder = os.path.join(created_server.config['CACHE_FOLDER'], 'templates')
+
+	for case_name, clear_cache in (('empty template cache', True), ('filled template cache', False)):
+		times = []
+
+		for _ in range(run_count):
+			if clear_cache:
+				shutil.rmtree(template_cache_folder, ignore_errors=True)
+
+			output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, work_path], capture_output=True, text=True, check=True).stdout
+			times.append([float(value) for value in output.split()])
+
+		startup_time, first_request_time, second_request_time = (sum(column) / run_count for column in zip(*times))
+
+		print(f'{case_name:>24}: {startup_time * 1000:8.1f} ms startup, {first_request_time * 1000:6.2f} ms first request, {second_request_time * 1000:6.2f} ms second request')
+
+
+BENCHMARKS = {
+	'database': benchmark_database,
+	'cleaning': benchmark_cleaning,
+	'production': benchmark_production,
+	'startup': benchmark_startup
+}
+
+
+if __name__ == '__main__':
+	try:
+		benchmark_names = sys.argv[1:] or BENCHMARKS.keys()
+		benchmarks = [BENCHMARKS[name] for name in benchmark_names]
+	except KeyError as exception:
+		benchmark_list = ', '.join(BENCHMARKS.keys())
+		logger.error(f'Invalid benchmark: {exception}, try one of: {benchmark_list}')
+
+	for benchmark_name, benchmark in zip(benchmark_names, benchmarks):
+		logger.notice(f'Running benchmark: \'{benchmark_name}\'')
+		benchmark()
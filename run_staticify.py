@@ -2,155 +2,303 @@ from jinja2 import Environment, FileSystemLoader
 
 import sqlite3
 
-from markdown import markdown
-import bleach
-
 import minify_html
 
 import os
-from shutil import rmtree, copyfile, copytree
+import sys
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from shutil import rmtree, copy2, copytree
 
 from load_config import Config
+import rendering
+import compression
+import derivatives
+import search
 
 
-# --------------------------------------- #
-# Prepare export folder
-# --------------------------------------- #
-try:
-	rmtree('export')
-except FileNotFoundError:
-	pass
+EXPORT_FOLDER = 'export'
+MANIFEST_PATH = os.path.join(EXPORT_FOLDER, '.manifest.json')
 
-os.mkdir('export')
+TEMPLATES_FOLDER = 'src/templates'
+CONFIG_PATH = 'configuration.toml'
 
 
 # --------------------------------------- #
 # Setup
 # --------------------------------------- #
 config = Config()
-config.load('configuration.toml')
+config.load(CONFIG_PATH)
 
 
-file_system_loader = FileSystemLoader('src/templates')
+file_system_loader = FileSystemLoader(TEMPLATES_FOLDER)
 environment = Environment(loader=file_system_loader)
 
-database = sqlite3.connect('instance/main.db')
+rendering.set_template_cache(environment, 'instance/cache/templates')
+rendering.load_templates(environment)
 
+stylesheet = rendering.render_stylesheet(environment, config)
+stylesheet_name = rendering.get_stylesheet_name(stylesheet)
 
-# --------------------------------------- #
-# Export: Static Files
-# --------------------------------------- #
-copytree('src/static', 'export/static')
+environment.globals['stylesheetName'] = stylesheet_name
 
 
 # --------------------------------------- #
-# Export: Stylesheet
+# Manifest
 # --------------------------------------- #
-template = environment.get_template('main.css')
-output = template.render(colorBackground=config.site_color_background, colorBackgroundAccent=config.site_color_background_accent, colorAccent=config.site_color_accent, colorAccentHover=config.site_color_accent_hover)
+def get_post_hash(post_info: dict) -> str:
+	post_hash = hashlib.sha256(json.dumps(post_info, sort_keys=True).encode())
+
+	with open(f'instance/posts/{post_info['content_link']}', 'rb') as file:
+		post_hash.update(file.read())
+
+	return post_hash.hexdigest()
+
+def load_manifest() -> dict:
+	try:
+		with open(MANIFEST_PATH, 'r') as file:
+			return json.load(file)
+	except (FileNotFoundError, ValueError):
+		return {'site': None, 'posts': {}}
+
+def save_manifest(manifest: dict) -> None:
+	with open(MANIFEST_PATH, 'w') as file:
+		json.dump(manifest, file)
 
-with open('export/main.css', 'w') as file:
-	file.write(output)
 
 # --------------------------------------- #
-# Export: Homepage
+# Renderers
 # --------------------------------------- #
-with database:
-	database.row_factory = sqlite3.Row
+def write_page(path: str, output: str) -> None:
+	os.makedirs(os.path.dirname(path), exist_ok=True)
 
-	cursor = database.cursor()
-	cursor.execute('SELECT * FROM posts')
+	with open(path, 'w') as file:
+		file.write(minify_html.minify(output))
 
-	posts = cursor.fetchmany(3)
-	posts.reverse()
+	compression.write_compressed_siblings(path, config)
 
-template = environment.get_template('homepage.html')
-output = template.render(siteName=config.site_name, user=False, recentPosts=posts, permissions=[], footnote=config.footnote, linkBadges=config.link_badges)
+def export_post(post_info: dict) -> str:
+	if rendering.is_artifact_current(post_info['render_version'], post_info['render_fingerprint'], config) \
+		and not rendering.is_artifact_stale('instance/posts', post_info['content_link']):
+		with open(rendering.get_artifact_path('instance/posts', post_info['content_link']), 'r') as file:
+			post_content = file.read()
+	else:
+		with open(f'instance/posts/{post_info['content_link']}', 'r') as file:
+			post_content = rendering.render_markdown(file.read(), config)
 
-output = minify_html.minify(output)
+	output = environment.get_template('post.html').render(
+		id = post_info['id'],
 
-with open('export/index.html', 'w') as file:
-	file.write(output)
+		siteName = config.site_name,
+		pageName = post_info['title'],
+		content = post_content,
 
-# --------------------------------------- #
-# Export: All posts page
-# --------------------------------------- #
-with database:
-	database.row_factory = sqlite3.Row
+		like_count = post_info['like_count'],
+
+		permissions=[],
 
-	cursor = database.cursor()
-	cursor.execute('SELECT * FROM posts')
+		footnote = config.footnote,
 
-	posts = cursor.fetchall()
-	posts.reverse()
+		user = False,
 
-template = environment.get_template('posts.html')
-output = template.render(siteName=config.site_name, posts=posts, user=False, permissions=[], footnote=config.footnote, linkBadges=config.link_badges)
+		linkBadges=config.link_badges
+	)
 
-output = minify_html.minify(output)
+	write_page(f'{EXPORT_FOLDER}/posts/{post_info['id']}/index.html', output)
 
-os.mkdir('export/posts')
+	return post_info['id']
 
-with open('export/posts/index.html', 'w') as file:
-	file.write(output)
 
-# --------------------------------------- #
-# Export: Post pages
-# --------------------------------------- #
-with database:
+def main(arguments: list[str]) -> None:
+	full_rebuild = '--full' in arguments
+
+	if full_rebuild:
+		try:
+			rmtree(EXPORT_FOLDER)
+		except FileNotFoundError:
+			pass
+
+	os.makedirs(EXPORT_FOLDER, exist_ok=True)
+
+	manifest = load_manifest()
+
+	site_hash = rendering.get_site_hash(TEMPLATES_FOLDER, CONFIG_PATH)
+	site_changed = manifest['site'] != site_hash
+
+	database = sqlite3.connect('instance/main.db')
 	database.row_factory = sqlite3.Row
 
-	cursor = database.cursor()
-	cursor.execute('SELECT * FROM posts')
 
-	posts = cursor.fetchall()
+	# --------------------------------------- #
+	# Export: Static Files
+	# --------------------------------------- #
+	copytree('src/static', f'{EXPORT_FOLDER}/static', dirs_exist_ok=True)
 
-template = environment.get_template('post.html')
 
-for post_info in posts:
-	with open(f'instance/posts/{post_info['content_link']}', 'r') as file:
-		post_content = file.read()
+	# --------------------------------------- #
+	# Export: Stylesheet
+	# --------------------------------------- #
+	if site_changed:
+		for name in os.listdir(EXPORT_FOLDER):
+			if name.startswith('main.') and '.css' in name:
+				os.remove(f'{EXPORT_FOLDER}/{name}')
 
-	post_content = markdown(post_content)
-	post_content = bleach.clean(post_content, tags=config.allowed_clean_html_tags, attributes=config.allowed_clean_html_attributes)
+		with open(f'{EXPORT_FOLDER}/{stylesheet_name}', 'w') as file:
+			file.write(stylesheet)
 
-	output = template.render(
-		id = post_info['id'],
+		compression.write_compressed_siblings(f'{EXPORT_FOLDER}/{stylesheet_name}', config)
 
-		siteName = config.site_name,
-		pageName = post_info['title'],
-		content = post_content,
 
-		like_count = post_info['like_count'],
+	# --------------------------------------- #
+	# Export: Homepage
+	# --------------------------------------- #
+	with database:
+		cursor = database.cursor()
+		cursor.execute('SELECT * FROM posts ORDER BY created_at DESC, id DESC')
 
-		permissions=[],
+		posts = [dict(post_info) for post_info in cursor.fetchall()]
 
-		footnote = config.footnote,
+	template = environment.get_template('homepage.html')
+	output = template.render(siteName=config.site_name, user=False, recentPosts=posts[0:3], permissions=[], footnote=config.footnote, linkBadges=config.link_badges)
 
-		user = False,
+	write_page(f'{EXPORT_FOLDER}/index.html', output)
 
-		linkBadges=config.link_badges
-	)
 
-	output = minify_html.minify(output)
+	# --------------------------------------- #
+	# Export: All posts page
+	# --------------------------------------- #
+	template = environment.get_template('posts.html')
+	output = template.render(siteName=config.site_name, posts=posts, user=False, permissions=[], footnote=config.footnote, linkBadges=config.link_badges)
 
-	os.mkdir(f'export/posts/{post_info['id']}')
+	write_page(f'{EXPORT_FOLDER}/posts/index.html', output)
 
-	with open(f'export/posts/{post_info['id']}/index.html', 'w') as file:
-		file.write(output)
 
-# --------------------------------------- #
-# Export: File Storage
-# --------------------------------------- #
-with database:
-	database.row_factory = sqlite3.Row
+	# --------------------------------------- #
+	# Export: Post pages
+	# --------------------------------------- #
+	post_hashes = {post_info['id']: get_post_hash(post_info) for post_info in posts}
+
+	changed_posts = [
+		post_info for post_info in posts
+		if site_changed or manifest['posts'].get(post_info['id']) != post_hashes[post_info['id']]
+	]
+
+	removed_ids = manifest['posts'].keys() - post_hashes.keys()
+
+	for removed_id in removed_ids:
+		rmtree(f'{EXPORT_FOLDER}/posts/{removed_id}', ignore_errors=True)
+
+	if changed_posts:
+		with ProcessPoolExecutor(max_workers=config.export_workers or None) as executor:
+			for _ in executor.map(export_post, changed_posts, chunksize=max(1, len(changed_posts) // 64)):
+				pass
+
+	print(f'Exported {len(changed_posts)} of {len(posts)} post(s)')
+
+
+	# --------------------------------------- #
+	# Export: Search
+	# --------------------------------------- #
+	if site_changed or changed_posts or removed_ids or not os.path.exists(f'{EXPORT_FOLDER}/search_index.json'):
+		search_posts = []
+
+		for post_info in posts:
+			with open(rendering.get_artifact_path('instance/posts', post_info['content_link']), 'r') as file:
+				search_posts.append(post_info | {'content': search.get_text(file.read())})
+
+		with open(f'{EXPORT_FOLDER}/search_index.json', 'w') as file:
+			file.write(search.build_static_index(search_posts))
+
+		compression.write_compressed_siblings(f'{EXPORT_FOLDER}/search_index.json', config)
+
+		template = environment.get_template('search.html')
+		output = template.render(siteName=config.site_name, user=False, query='', results=[], staticSearch=True, permissions=[], footnote=config.footnote, linkBadges=config.link_badges)
+
+		write_page(f'{EXPORT_FOLDER}/posts/search/index.html', output)
+
+
+	# --------------------------------------- #
+	# Export: Pages
+	# --------------------------------------- #
+	page_names = rendering.get_page_names('instance/pages')
+
+	for name in page_names:
+		template = environment.get_template('page.html')
+		output = template.render(siteName=config.site_name, pageName=rendering.get_page_title(name), content=rendering.render_page(f'instance/pages/{name}.md'), user=False, permissions=[], footnote=config.footnote, linkBadges=config.link_badges)
+
+		write_page(f'{EXPORT_FOLDER}/pages/{name}/index.html', output)
+
+	if os.path.isdir(f'{EXPORT_FOLDER}/pages'):
+		for name in set(os.listdir(f'{EXPORT_FOLDER}/pages')) - set(page_names):
+			rmtree(f'{EXPORT_FOLDER}/pages/{name}')
+
+	template = environment.get_template('page.html')
+	output = template.render(siteName=config.site_name, pageName='Copyright', content=rendering.render_page('COPYRIGHT.md'), user=False, permissions=[], footnote=config.footnote, linkBadges=config.link_badges)
+
+	write_page(f'{EXPORT_FOLDER}/copyright/index.html', output)
+
+
+	# --------------------------------------- #
+	# Export: File Storage
+	# --------------------------------------- #
+	with database:
+		cursor = database.cursor()
+		cursor.execute('SELECT * FROM file_storage')
+
+		files = cursor.fetchall()
+
+	os.makedirs(f'{EXPORT_FOLDER}/file_storage', exist_ok=True)
+
+	file_ids = set()
+
+	for file in files:
+		source_path = f'instance/uploads/{file['content_link']}'
+		export_path = f'{EXPORT_FOLDER}/file_storage/{file['id']}'
+
+		file_ids.add(file['id'])
+
+		try:
+			source_stat = os.stat(source_path)
+			export_stat = os.stat(export_path)
+		except FileNotFoundError:
+			export_stat = None
+
+		if export_stat is None or source_stat.st_size != export_stat.st_size or source_stat.st_mtime_ns != export_stat.st_mtime_ns:
+			copy2(source_path, export_path)
+
+			if compression.is_compressible_file(export_path):
+				compression.write_compressed_siblings(export_path, config)
+
+		# Resized images go to file_storage/<width>/<file>, since a static site can't look at ?w=
+		if not config.image_derivatives_enabled or file['content_hash'] == '':
+			continue
+
+		for width in config.image_derivatives_widths:
+			derivative_path = f'instance/uploads/{derivatives.get_derivative_link(file['content_hash'], width, derivatives.get_extension(file['id']))}'
+
+			if os.path.exists(derivative_path):
+				os.makedirs(f'{EXPORT_FOLDER}/file_storage/{width}', exist_ok=True)
+				copy2(derivative_path, f'{EXPORT_FOLDER}/file_storage/{width}/{file['id']}')
+
+	derivative_folders = {str(width) for width in config.image_derivatives_widths}
+
+	for name in os.listdir(f'{EXPORT_FOLDER}/file_storage'):
+		if name in derivative_folders:
+			for derivative_name in os.listdir(f'{EXPORT_FOLDER}/file_storage/{name}'):
+				if derivative_name not in file_ids:
+					os.remove(f'{EXPORT_FOLDER}/file_storage/{name}/{derivative_name}')
+		elif os.path.isdir(f'{EXPORT_FOLDER}/file_storage/{name}'):
+			rmtree(f'{EXPORT_FOLDER}/file_storage/{name}')
+		elif name.removesuffix('.gz').removesuffix('.br') not in file_ids:
+			os.remove(f'{EXPORT_FOLDER}/file_storage/{name}')
+
 
-	cursor = database.cursor()
-	cursor.execute('SELECT * FROM file_storage')
+	manifest['site'] = site_hash
+	manifest['posts'] = post_hashes
 
-	files = cursor.fetchall()
+	save_manifest(manifest)
 
-os.mkdir(f'export/file_storage')
 
-for file in files:
-	copyfile(f'instance/uploads/{file['content_link']}', f'export/file_storage/{file['id']}')
+if __name__ == '__main__':
+	main(sys.argv[1:])
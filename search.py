@@ -0,0 +1,103 @@
+import re
+import json
+import unicodedata
+from html.parser import HTMLParser
+
+
+SEARCH_TABLE = 'posts_search'
+
+# Every row shares its rowid with the post it indexes, the content is the text of the sanitized post
+SEARCH_TABLE_STATEMENT = f'CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(title, description, content, tokenize = \'unicode61 remove_diacritics 2\')'
+
+# Title matches rank above description matches, which rank above content matches
+COLUMN_WEIGHTS = {
+	'title': 10,
+	'description': 5,
+	'content': 1
+}
+
+SNIPPET_WORDS = 24
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+# --------------------------------------- #
+# Queries
+# --------------------------------------- #
+# Every word is quoted so FTS5 syntax in user input is matched literally, the last one also matches as a prefix
+def get_match_query(query: str) -> str:
+	words = [word.replace('"', '""') for word in query.split()]
+
+	if not words:
+		return ''
+
+	return ' '.join(f'"{word}"' for word in words) + '*'
+
+def get_rank_expression() -> str:
+	return f'bm25({SEARCH_TABLE}, {', '.join(str(weight) for weight in COLUMN_WEIGHTS.values())})'
+
+
+# --------------------------------------- #
+# Text
+# --------------------------------------- #
+# Words in separate blocks are kept apart, inline tags like <em> can sit inside a word
+BLOCK_TAGS = frozenset((
+	'p', 'div', 'br', 'hr', 'pre', 'blockquote',
+	'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+	'ul', 'ol', 'li', 'table', 'tr', 'th', 'td'
+))
+
+class TextParser(HTMLParser):
+	def __init__(self):
+		super().__init__()
+
+		self.pieces = []
+
+	def handle_starttag(self, tag: str, attributes):
+		if tag in BLOCK_TAGS:
+			self.pieces.append(' ')
+
+	def handle_endtag(self, tag: str):
+		if tag in BLOCK_TAGS:
+			self.pieces.append(' ')
+
+	def handle_data(self, data: str):
+		self.pieces.append(data)
+
+# The visible text of rendered html, with entities decoded and whitespace collapsed
+def get_text(html: str) -> str:
+	parser = TextParser()
+	parser.feed(html)
+	parser.close()
+
+	return ' '.join(''.join(parser.pieces).split())
+
+
+# --------------------------------------- #
+# Static Index
+# --------------------------------------- #
+# Lowercased and without diacritics, like the unicode61 tokenizer
+def get_words(text: str) -> set[str]:
+	text = unicodedata.normalize('NFKD', text.lower())
+	text = ''.join(letter for letter in text if not unicodedata.combining(letter))
+
+	return {word for word in WORD_PATTERN.findall(text) if len(word) > 1}
+
+# {"posts": [[id, title, description], ...], "terms": {word: [post index, weight, post index, weight, ...]}}
+def build_static_index(posts: list[dict]) -> str:
+	terms = {}
+
+	for index, post_info in enumerate(posts):
+		weights = {}
+
+		for column, weight in COLUMN_WEIGHTS.items():
+			for word in get_words(post_info[column]):
+				weights[word] = max(weights.get(word, 0), weight)
+
+		for word, weight in weights.items():
+			terms.setdefault(word, []).extend((index, weight))
+
+	return json.dumps({
+		'posts': [[post_info['id'], post_info['title'], post_info['description']] for post_info in posts],
+		'terms': terms
+	}, separators=(',', ':'), ensure_ascii=False)
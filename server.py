@@ -1,36 +1,68 @@
 from flask import (
 	Flask,
+	Request,
+	current_app,
+	g,
 	request,
 	Response,
 	send_from_directory,
 	render_template,
-	stream_template,
+	stream_with_context,
 	jsonify,
+	redirect,
 	abort
 )
 
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import Mapped, mapped_column
+import sqlalchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 import flask_login
-
-from markdown import markdown
-import bleach
+from markupsafe import escape
 
 import os
+import re
+import json
+import tarfile
+import multiprocessing
+import mimetypes
+import time
+import hashlib
+import tempfile
+import functools
+import itertools
+import math
+import urllib.parse
+import atexit
 import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from datetime import datetime, timezone
 
 from load_config import Config
+import logger
+from caching import LRUCache, TTLCache
+from atomic_files import atomic_path, write_atomic
+import rendering
+import compression
+import derivatives
+import search
+import import_worker
 
 
 # --------------------------------------- #
 # Site Configuration
 # --------------------------------------- #
+CONFIG_PATH = 'configuration.toml'
+
 config = Config()
-config.load('configuration.toml')
+config.load(CONFIG_PATH)
 
 
 # --------------------------------------- #
@@ -39,24 +71,41 @@ config.load('configuration.toml')
 database = SQLAlchemy()
 login_manager = flask_login.LoginManager()
 
+post_cache = LRUCache(config.post_cache_max_entries)
+
+compression_cache = LRUCache(config.compression_cache_max_entries)
+
+derivative_generator = derivatives.DerivativeGenerator(config)
+
+# Other workers may keep serving a removed file until their entry expires
+file_cache = TTLCache(config.file_storage_cache_ttl, config.file_storage_cache_max_entries)
+
+page_cache = LRUCache(config.page_cache_max_entries, keep_evicted=False)
+
+markdown_pages = rendering.MarkdownPages()
+
+api_key_cache = TTLCache(config.api_keys_cache_ttl, config.api_keys_cache_max_entries)
+unknown_api_key_cache = TTLCache(config.api_keys_negative_cache_ttl, config.api_keys_cache_max_entries)
+
 
 # --------------------------------------- #
 # Sanatizers
 # --------------------------------------- #
-def get_cleaned_string(name: str, allowed_characters=config.allowed_clean_characters, separator=' ', all_lower=False):
+@functools.lru_cache(maxsize=16)
+def get_clean_pattern(allowed_characters: frozenset) -> re.Pattern:
+	return re.compile('[^' + ''.join(re.escape(letter) for letter in sorted(allowed_characters)) + ' ]')
+
+def get_cleaned_string(name: str, allowed_characters=config.allowed_clean_characters_set, separator=' ', all_lower=False):
 	if all_lower:
 		name = name.lower()
 	name = name.replace('  ', '')
 
-	final = ''
+	name = get_clean_pattern(allowed_characters).sub('', name)
 
-	for letter in name:
-		if letter in allowed_characters:
-			final += letter
-		elif letter == ' ':
-			final += separator
+	if ' ' not in allowed_characters:
+		name = name.replace(' ', separator)
 
-	return final
+	return name
 
 
 # --------------------------------------- #
@@ -64,6 +113,9 @@ def get_cleaned_string(name: str, allowed_characters=config.allowed_clean_charac
 # --------------------------------------- #
 class DatabasePost(database.Model):
 	__tablename__ = 'posts'
+	__table_args__ = (
+		sqlalchemy.Index('ix_posts_created_at', 'created_at', 'id'),
+	)
 
 	id: Mapped[str] = mapped_column(primary_key=True, nullable=False)
 	title: Mapped[str] = mapped_column(nullable=False)
@@ -72,50 +124,163 @@ class DatabasePost(database.Model):
 	content_link: Mapped[str] = mapped_column(nullable=False)
 	like_count: Mapped[int] = mapped_column(nullable=False)
 
+	render_version: Mapped[int] = mapped_column(nullable=False, default=0)
+	render_fingerprint: Mapped[str] = mapped_column(nullable=False, default='')
+
+	content_hash: Mapped[str] = mapped_column(nullable=False, default='')
+
+	created_at: Mapped[float] = mapped_column(nullable=False, default=time.time)
+	updated_at: Mapped[float] = mapped_column(nullable=False, default=time.time)
+
+
+# Taken by routes under /posts/ and /api/v0/posts/, a post with one of these ids couldn't be reached
+RESERVED_POST_IDS = frozenset(('create', 'import', 'search'))
 
 def create_post(server: Flask, title: str, author: str = '(no author)', description: str = '(no description)', content: str = '(no content)'):
-	id = get_cleaned_string(title, allowed_characters=config.allowed_clean_letters, separator='-', all_lower=True)
+	id = get_cleaned_string(title, allowed_characters=config.allowed_clean_letters_set, separator='-', all_lower=True)
+
+	# Answered like an id that is already taken
+	if id in RESERVED_POST_IDS:
+		raise FileExistsError(f'Reserved post id: \'{id}\'')
 
 	with open(os.path.join(server.config['POSTS_FOLDER'], id), 'x') as file:
 		file.write(content)
 
+	post_content = rendering.write_artifact(server.config['POSTS_FOLDER'], id, config)
+
 	post = DatabasePost(
 		id = id,
 		title = get_cleaned_string(title),
 		author = get_cleaned_string(author),
 		description = get_cleaned_string(description),
 		content_link = id,
-		like_count = 0
+		like_count = 0,
+		render_version = rendering.RENDER_VERSION,
+		render_fingerprint = config.allowed_clean_html_fingerprint,
+		content_hash = rendering.get_content_hash(post_content)
 	)
 
 	database.session.add(post)
+	database.session.flush()
+
+	index_post(post, post_content, replace=False)
+	database.session.commit()
+
+	touch_page_stamp('posts')
+
+def get_posts_page(after: str | None = None, limit: int = config.posts_per_page, since: float | None = None):
+	query = DatabasePost.query.order_by(DatabasePost.created_at.desc(), DatabasePost.id.desc())
+
+	if since is not None:
+		query = query.filter(DatabasePost.updated_at > since)
+
+	if after:
+		try:
+			after_created_at, after_id = after.split(':', 1)
+			after_created_at = float(after_created_at)
+		except ValueError:
+			abort(400)
+
+		query = query.filter(sqlalchemy.tuple_(DatabasePost.created_at, DatabasePost.id) < (after_created_at, after_id))
+
+	posts = query.limit(limit + 1).all()
+
+	if len(posts) <= limit:
+		return posts, None
+
+	posts = posts[0:limit]
+	return posts, f'{posts[-1].created_at!r}:{posts[-1].id}'
+
+# Pages of at most batch_size posts until limit is reached, only one page is loaded at a time.
+# The last page comes with the cursor to continue from, or None once there are no more posts.
+def iterate_posts_pages(after: str | None = None, since: float | None = None, limit: int | None = None, batch_size: int = 500):
+	remaining = limit
+
+	while True:
+		posts, after = get_posts_page(after, batch_size if remaining is None else min(batch_size, remaining), since)
+
+		if remaining is not None:
+			remaining -= len(posts)
+
+		yield posts, after
+
+		if after is None or remaining == 0:
+			return
+
+def rerender_post(server: Flask, post_info: DatabasePost):
+	post_content = rendering.write_artifact(server.config['POSTS_FOLDER'], post_info.content_link, config)
+
+	post_info.render_version = rendering.RENDER_VERSION
+	post_info.render_fingerprint = config.allowed_clean_html_fingerprint
+	post_info.content_hash = rendering.get_content_hash(post_content)
+	post_info.updated_at = time.time()
+
+	index_post(post_info, post_content)
+
 	database.session.commit()
 
+	touch_page_stamp('posts')
+
+def is_post_rendered(server: Flask, post_info: DatabasePost) -> bool:
+	return rendering.is_artifact_current(post_info.render_version, post_info.render_fingerprint, config) \
+		and post_info.content_hash != '' \
+		and not rendering.is_artifact_stale(server.config['POSTS_FOLDER'], post_info.content_link)
+
+def migrate_posts(server: Flask) -> int:
+	rerendered = 0
+
+	for post_info in DatabasePost.query.all():
+		if is_post_rendered(server, post_info):
+			continue
+
+		rerender_post(server, post_info)
+		rerendered += 1
+
+	return rerendered
+
 def get_post(server: Flask, id: str):
 	post_info = database.get_or_404(DatabasePost, id)
 
-	with open(os.path.join(server.config['POSTS_FOLDER'], post_info.content_link), 'r') as file:
+	return post_info, get_post_content(server, post_info)
+
+def get_post_content(server: Flask, post_info: DatabasePost) -> str:
+	if not is_post_rendered(server, post_info):
+		rerender_post(server, post_info)
+
+	artifact_path = rendering.get_artifact_path(server.config['POSTS_FOLDER'], post_info.content_link)
+
+	cache_key = (post_info.id, os.stat(artifact_path).st_mtime_ns, config.allowed_clean_html_fingerprint)
+
+	post_content = post_cache.get(cache_key)
+	if post_content is not None:
+		return post_content
+
+	with open(artifact_path, 'r') as file:
 		post_content = file.read()
 
-	post_content = markdown(post_content)
-	post_content = bleach.clean(post_content, tags=config.allowed_clean_html_tags, attributes=config.allowed_clean_html_attributes)
+	post_cache.set(cache_key, post_content)
+
+	return post_content
 
-	return post_info, post_content
+POST_FIELDS = frozenset(('id', 'title', 'author', 'description', 'like_count', 'created_at', 'updated_at', 'content'))
+DEFAULT_POST_FIELDS = ('id', 'title', 'author', 'description', 'like_count')
+
+# The rendered content is only read when it is asked for
+def get_post_fields(server: Flask, post_info: DatabasePost, fields) -> dict:
+	return {
+		field: get_post_content(server, post_info) if field == 'content' else getattr(post_info, field)
+		for field in fields
+	}
 
 def render_post(server, id: str):
 	post_info, post_content = get_post(server, id)
 
-	try:
-		user_id = flask_login.current_user.id
-		user_role = config.roles[flask_login.current_user.role]
-		user_logged_in = True
-	except AttributeError:
-		user_role = config.roles['guest']
-		user_logged_in = False
+	etag = get_etag(server.config['SITE_HASH'], post_info.content_hash, post_info.title, post_info.like_count, g.user_role)
 
-	user_permissions = user_role['permissions']
+	if not is_modified(etag):
+		return set_validators(server.response_class(status=304), etag, post_info.updated_at)
 
-	return stream_template(
+	response = server.response_class(render_template(
 		'post.html',
 
 		id = id,
@@ -126,22 +291,563 @@ def render_post(server, id: str):
 
 		like_count = post_info.like_count,
 
-		permissions=user_permissions,
+		permissions=g.user_permissions,
 
 		footnote = config.footnote,
 
-		user = user_logged_in,
+		user = g.user_logged_in,
 
 		linkBadges=config.link_badges
-	)
+	))
+
+	return set_validators(response, etag, post_info.updated_at)
 
 def like_post(id: str):
-	post_info = database.get_or_404(DatabasePost, id)
+	if config.likes_buffered:
+		# The stamp is replaced once the buffer is flushed
+		return like_buffer.add(id)
+
+	statement = sqlalchemy.update(DatabasePost) \
+		.where(DatabasePost.id == id) \
+		.values(like_count=DatabasePost.like_count + 1, updated_at=time.time()) \
+		.returning(DatabasePost.like_count) \
+		.execution_options(synchronize_session=False)
+
+	like_count = database.session.execute(statement).scalar_one_or_none()
+
+	if like_count is None:
+		abort(404)
+
+	database.session.commit()
+
+	touch_page_stamp(f'likes-{id}')
+
+	return like_count
+
+
+class LikeBuffer:
+	def __init__(self, flush_interval: float):
+		self.flush_interval = flush_interval
+
+		self.pending = {}
+		self._lock = threading.Lock()
+
+		self._server = None
+		self._thread = None
+		self._thread_pid = None
+
+	def add(self, id: str) -> int:
+		like_count = database.session.execute(
+			sqlalchemy.select(DatabasePost.like_count).where(DatabasePost.id == id)
+		).scalar_one_or_none()
+
+		if like_count is None:
+			abort(404)
+
+		self._ensure_started()
+
+		with self._lock:
+			self.pending[id] = self.pending.get(id, 0) + 1
+			return like_count + self.pending[id]
+
+	# Started lazily so every worker process gets its own flush thread
+	def _ensure_started(self):
+		if self._thread_pid == os.getpid():
+			return
+
+		self._server = current_app._get_current_object()
+		self._thread_pid = os.getpid()
+
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		while True:
+			time.sleep(self.flush_interval)
+
+			# The failed counts are back in pending, so they are retried with the next flush
+			try:
+				self.flush()
+			except Exception as exception:
+				logger.notice(f'Could not flush likes: {exception}')
+
+	def flush(self):
+		with self._lock:
+			pending = self.pending
+			self.pending = {}
+
+		if not pending or self._server is None:
+			return
+
+		posts_table = DatabasePost.__table__
+
+		with self._server.app_context():
+			try:
+				database.session.execute(
+					posts_table.update()
+						.where(posts_table.c.id == sqlalchemy.bindparam('post_id'))
+						.values(like_count=posts_table.c.like_count + sqlalchemy.bindparam('likes'), updated_at=time.time()),
+					[{'post_id': id, 'likes': likes} for id, likes in pending.items()]
+				)
+				database.session.commit()
+			except Exception:
+				database.session.rollback()
+
+				with self._lock:
+					for id, likes in pending.items():
+						self.pending[id] = self.pending.get(id, 0) + likes
+
+				raise
+
+			for id in pending.keys():
+				touch_page_stamp(f'likes-{id}')
+
+
+like_buffer = LikeBuffer(config.likes_flush_interval)
+atexit.register(like_buffer.flush)
+
+
+# --------------------------------------- #
+# Search
+# --------------------------------------- #
+# Callers commit, so the index changes together with the post
+# Rows are looked up by the post's rowid, the primary key of the search table
+SEARCH_INSERT_STATEMENT = sqlalchemy.text(
+	f'INSERT INTO {search.SEARCH_TABLE} (rowid, title, description, content) '
+	f'SELECT rowid, :title, :description, :content FROM {DatabasePost.__tablename__} WHERE id = :id'
+)
+
+SEARCH_DELETE_STATEMENT = sqlalchemy.text(
+	f'DELETE FROM {search.SEARCH_TABLE} WHERE rowid = (SELECT rowid FROM {DatabasePost.__tablename__} WHERE id = :id)'
+)
+
+def get_search_row(id: str, title: str, description: str, post_content: str) -> dict:
+	return {'id': id, 'title': title, 'description': description, 'content': search.get_text(post_content)}
+
+# Callers commit, so the index changes together with the post. New posts have no row to replace yet.
+def index_post(post_info: DatabasePost, post_content: str, replace: bool = True):
+	if replace:
+		database.session.execute(SEARCH_DELETE_STATEMENT, {'id': post_info.id})
+
+	database.session.execute(SEARCH_INSERT_STATEMENT, get_search_row(post_info.id, post_info.title, post_info.description, post_content))
+
+def rebuild_search_index(server: Flask) -> int:
+	database.session.execute(sqlalchemy.text(f'DELETE FROM {search.SEARCH_TABLE}'))
+
+	indexed = 0
+
+	for post_info in DatabasePost.query.all():
+		with open(rendering.get_artifact_path(server.config['POSTS_FOLDER'], post_info.content_link), 'r') as file:
+			index_post(post_info, file.read(), replace=False)
+
+		indexed += 1
 
-	post_info.like_count += 1
 	database.session.commit()
 
-	return post_info.like_count
+	return indexed
+
+# Also replaces an index created by an older version of the statement
+def create_search_index(server: Flask):
+	with database.engine.begin() as connection:
+		statement = connection.execute(
+			sqlalchemy.text('SELECT sql FROM sqlite_master WHERE name = :name'), {'name': search.SEARCH_TABLE}
+		).scalar_one_or_none()
+
+		if statement == search.SEARCH_TABLE_STATEMENT:
+			return
+
+		if statement is not None:
+			connection.execute(sqlalchemy.text(f'DROP TABLE {search.SEARCH_TABLE}'))
+
+		connection.execute(sqlalchemy.text(search.SEARCH_TABLE_STATEMENT))
+
+	rebuild_search_index(server)
+
+def search_posts(query: str, page: int = 1, limit: int = config.posts_per_page):
+	match_query = search.get_match_query(query)
+
+	if not match_query:
+		return [], None
+
+	rows = database.session.execute(
+		sqlalchemy.text(
+			f'SELECT {DatabasePost.__tablename__}.id, snippet({search.SEARCH_TABLE}, 2, \'\', \'\', \'…\', {search.SNIPPET_WORDS}) '
+			f'FROM {search.SEARCH_TABLE} JOIN {DatabasePost.__tablename__} ON {DatabasePost.__tablename__}.rowid = {search.SEARCH_TABLE}.rowid '
+			f'WHERE {search.SEARCH_TABLE} MATCH :query ORDER BY {search.get_rank_expression()} LIMIT :limit OFFSET :offset'
+		),
+		{'query': match_query, 'limit': limit + 1, 'offset': (page - 1) * limit}
+	).all()
+
+	next_page = page + 1 if len(rows) > limit else None
+	rows = rows[0:limit]
+
+	posts = {post_info.id: post_info for post_info in DatabasePost.query.filter(DatabasePost.id.in_([id for id, _ in rows]))}
+
+	return [(posts[id], snippet) for id, snippet in rows if id in posts], next_page
+
+
+# --------------------------------------- #
+# Post Import
+# --------------------------------------- #
+# One post per line: {"title": ..., "content": ..., "description": ..., "author": ..., "created_at": ...}
+def read_ndjson_posts(stream):
+	for line in stream:
+		if line.strip():
+			yield json.loads(line)
+
+# Every .md file is a post titled after its file name, read in order without seeking
+def read_tar_posts(stream):
+	with tarfile.open(fileobj=stream, mode='r|*') as archive:
+		for member in archive:
+			if not member.isfile() or not member.name.endswith('.md'):
+				continue
+
+			yield {
+				'title': rendering.get_page_title(os.path.basename(member.name).removesuffix('.md')),
+				'content': archive.extractfile(member).read().decode()
+			}
+
+def get_import_timestamp(value) -> float | None:
+	if value is None:
+		return time.time()
+
+	if isinstance(value, bool) or not isinstance(value, (int, float)):
+		return None
+
+	try:
+		value = float(value)
+	except OverflowError:
+		return None
+
+	return value if math.isfinite(value) else None
+
+# Returns the post's row without the rendered fields, or None if the post can't be imported
+def get_import_row(post, author: str | None) -> dict | None:
+	if not isinstance(post, dict) or not isinstance(post.get('title'), str) or not isinstance(post.get('content'), str):
+		return None
+
+	author = post.get('author') or author or '(no author)'
+	description = post.get('description') or '(no description)'
+	created_at = get_import_timestamp(post.get('created_at'))
+
+	if not isinstance(author, str) or not isinstance(description, str) or created_at is None:
+		return None
+
+	id = get_cleaned_string(post['title'], allowed_characters=config.allowed_clean_letters_set, separator='-', all_lower=True)
+	if not id or id in RESERVED_POST_IDS:
+		return None
+
+	return {
+		'id': id,
+		'title': get_cleaned_string(post['title']),
+		'author': get_cleaned_string(author),
+		'description': get_cleaned_string(description),
+		'content_link': id,
+		'like_count': 0,
+		'render_version': rendering.RENDER_VERSION,
+		'render_fingerprint': config.allowed_clean_html_fingerprint,
+		'created_at': created_at,
+		'updated_at': time.time()
+	}
+
+def sync_folder(folder: str):
+	descriptor = os.open(folder, os.O_RDONLY)
+
+	try:
+		os.fsync(descriptor)
+	finally:
+		os.close(descriptor)
+
+def import_post_batch(server: Flask, batch: list, author: str | None, executor: ProcessPoolExecutor) -> int:
+	posts_folder = server.config['POSTS_FOLDER']
+
+	# Every post is checked before the first file is written, so a bad post can't leave files without a row
+	batch_posts = {}
+
+	for post in batch:
+		row = get_import_row(post, author)
+
+		if row is not None and row['id'] not in batch_posts:
+			batch_posts[row['id']] = (row, post['content'])
+
+	existing_ids = set(database.session.execute(
+		sqlalchemy.select(DatabasePost.id).where(DatabasePost.id.in_(batch_posts.keys()))
+	).scalars())
+
+	new_posts = []
+	search_rows = []
+	written_paths = []
+
+	try:
+		for id, (row, content) in batch_posts.items():
+			if id in existing_ids:
+				continue
+
+			source_path = os.path.join(posts_folder, id)
+
+			try:
+				with open(source_path, 'x') as file:
+					written_paths.append(source_path)
+
+					file.write(content)
+					file.flush()
+					os.fsync(file.fileno())
+			except FileExistsError:
+				continue
+
+			new_posts.append((row, content))
+
+		if not new_posts:
+			return 0
+
+		rendered_contents = executor.map(import_worker.render_post, [content for _, content in new_posts], chunksize=max(1, len(new_posts) // 64))
+
+		for (row, _), post_content in zip(new_posts, rendered_contents):
+			written_paths.append(rendering.get_artifact_path(posts_folder, row['id']))
+			rendering.save_artifact(posts_folder, row['id'], post_content, sync=True)
+
+			row['content_hash'] = rendering.get_content_hash(post_content)
+			search_rows.append(get_search_row(row['id'], row['title'], row['description'], post_content))
+
+		# The files are on disk before the database can point at any of them
+		sync_folder(posts_folder)
+
+		database.session.execute(sqlalchemy.insert(DatabasePost), [row for row, _ in new_posts])
+		database.session.execute(SEARCH_INSERT_STATEMENT, search_rows)
+		database.session.commit()
+	except BaseException:
+		database.session.rollback()
+
+		for path in written_paths:
+			if os.path.exists(path):
+				os.remove(path)
+
+		raise
+
+	touch_page_stamp('posts')
+
+	return len(new_posts)
+
+# Yields the progress after every batch, author is used for posts that don't name their own
+def import_posts(server: Flask, posts, author: str | None = None):
+	imported = 0
+	read = 0
+
+	start_time = time.perf_counter()
+
+	# Forking a threaded worker isn't safe, the render processes start from a clean fork server instead
+	with ProcessPoolExecutor(
+		max_workers=config.post_import_workers or None,
+		mp_context=multiprocessing.get_context('forkserver'),
+		initializer=import_worker.load_config,
+		initargs=(os.path.abspath(CONFIG_PATH),)
+	) as executor:
+		batch = []
+
+		for post in posts:
+			batch.append(post)
+
+			if len(batch) < config.post_import_batch_size:
+				continue
+
+			imported += import_post_batch(server, batch, author, executor)
+			read += len(batch)
+			batch = []
+
+			yield get_import_progress(imported, read, start_time)
+
+		if batch:
+			imported += import_post_batch(server, batch, author, executor)
+			read += len(batch)
+
+	yield get_import_progress(imported, read, start_time)
+
+def get_import_progress(imported: int, read: int, start_time: float) -> dict:
+	elapsed_time = time.perf_counter() - start_time
+
+	return {
+		'imported': imported,
+		'skipped': read - imported,
+		'seconds': round(elapsed_time, 3),
+		'posts_per_second': round(imported / elapsed_time, 1) if elapsed_time else 0
+	}
+
+
+# --------------------------------------- #
+# Conditional Requests
+# --------------------------------------- #
+def get_etag(*parts) -> str:
+	return hashlib.sha256(':'.join(str(part) for part in parts).encode()).hexdigest()[0:32]
+
+# If-Modified-Since is ignored, the date doesn't change with the site hash or the user's role like the etag does
+def is_modified(etag: str) -> bool:
+	if not request.if_none_match:
+		return True
+
+	# Compressed responses carry the encoding in their etag, see compress_response().
+	# Compared weakly, proxies that compress responses themselves turn the etag into a weak one.
+	return not any(
+		request.if_none_match.contains_weak(etag_variant)
+		for etag_variant in (etag, *(f'{etag}-{encoding}' for encoding in compression.ENCODINGS))
+	)
+
+def set_validators(response: Response, etag: str, last_modified: float) -> Response:
+	response.set_etag(etag)
+	response.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+
+	response.cache_control.no_cache = True
+	response.vary.update(('Cookie', 'Authorization'))
+
+	return response
+
+
+# --------------------------------------- #
+# Compression
+# --------------------------------------- #
+def compress_response(response: Response) -> Response:
+	if response.status_code != 200 \
+		or response.direct_passthrough \
+		or response.is_streamed \
+		or 'Content-Encoding' in response.headers \
+		or response.mimetype not in compression.COMPRESSIBLE_MIMETYPES:
+		return response
+
+	response.vary.add('Accept-Encoding')
+
+	encoding = compression.negotiate_encoding(request.accept_encodings)
+	data = response.get_data()
+
+	if encoding is None or len(data) < config.compression_min_size:
+		return response
+
+	cache_key = (request.path, hashlib.sha256(data).hexdigest(), encoding)
+
+	compressed_data = compression_cache.get(cache_key)
+	if compressed_data is None:
+		compressed_data = compression.compress(data, encoding, config)
+		compression_cache.set(cache_key, compressed_data)
+
+	response.set_data(compressed_data)
+	response.headers['Content-Encoding'] = encoding
+
+	etag, is_weak = response.get_etag()
+	if etag:
+		response.set_etag(f'{etag}-{encoding}', is_weak)
+
+	return response
+
+# compress_response() skips streamed responses, they are compressed while they are sent instead
+def get_streamed_response(chunks, mimetype: str) -> Response:
+	encoding = compression.negotiate_encoding(request.accept_encodings)
+
+	if encoding:
+		chunks = compression.compress_stream(chunks, encoding, config)
+
+	response = Response(stream_with_context(chunks), mimetype=mimetype)
+	response.vary.add('Accept-Encoding')
+
+	if encoding:
+		response.headers['Content-Encoding'] = encoding
+
+	return response
+
+
+# --------------------------------------- #
+# Page Cache
+# --------------------------------------- #
+# Pages that look the same for every guest, cached whole and keyed by path and the query arguments they read.
+# Markdown pages are left out, they are already kept in memory and change without touching a stamp.
+CACHED_PAGE_ENDPOINTS = {
+	'route_homepage': (),
+	'route_get_posts': ('after',),
+	'route_get_post': (),
+	'route_user_login': (),
+	'route_user_register': ()
+}
+
+# Every worker caches its own pages, these files tell all of them when the data behind a page changed.
+# A stamp is a random token that is replaced on every change.
+def get_page_stamp(name: str) -> str:
+	try:
+		with open(os.path.join(current_app.config['PAGE_STAMPS_FOLDER'], name), 'r') as file:
+			return file.read()
+	except FileNotFoundError:
+		return ''
+
+def touch_page_stamp(name: str):
+	write_atomic(os.path.join(current_app.config['PAGE_STAMPS_FOLDER'], name), secrets.token_hex(8))
+
+def get_page_stamps() -> tuple[str, str]:
+	if request.endpoint == 'route_get_post':
+		return get_page_stamp('posts'), get_page_stamp(f'likes-{request.view_args['id']}')
+
+	return get_page_stamp('posts'), ''
+
+# Requests with other query arguments are not cached, they would only fill the cache with copies of a page
+def get_page_key() -> tuple | None:
+	arguments = CACHED_PAGE_ENDPOINTS[request.endpoint]
+
+	if any(name not in arguments or len(request.args.getlist(name)) > 1 for name in request.args):
+		return None
+
+	query = urllib.parse.urlencode({name: request.args[name] for name in arguments if name in request.args})
+
+	return (f'{request.path}?{query}' if query else request.path, current_app.config['SITE_HASH'])
+
+def serve_cached_page():
+	if not config.page_cache_enabled \
+		or request.method != 'GET' \
+		or request.endpoint not in CACHED_PAGE_ENDPOINTS \
+		or g.user_logged_in:
+		return None
+
+	g.page_key = get_page_key()
+	if g.page_key is None:
+		return None
+
+	# Read before rendering, so a change made while the page renders isn't hidden behind it
+	g.page_stamps = get_page_stamps()
+
+	entry = page_cache.get(g.page_key)
+	if entry is None:
+		return None
+
+	data, etag, last_modified, rendered_at, posts_stamp, likes_stamp = entry
+
+	if posts_stamp != g.page_stamps[0]:
+		return None
+
+	# Likes only make a page stale once it is older than the staleness window
+	if likes_stamp != g.page_stamps[1] and time.time() - rendered_at > config.page_cache_like_staleness:
+		return None
+
+	g.page_cached = True
+
+	if not is_modified(etag):
+		return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+	return set_validators(current_app.response_class(data, mimetype='text/html'), etag, last_modified)
+
+def cache_page(response: Response) -> Response:
+	if g.get('page_cached') \
+		or 'page_stamps' not in g \
+		or response.status_code != 200 \
+		or response.is_streamed \
+		or response.mimetype != 'text/html':
+		return response
+
+	data = response.get_data(as_text=True)
+
+	etag, _ = response.get_etag()
+	last_modified = response.last_modified.timestamp() if response.last_modified else time.time()
+
+	if etag is None:
+		etag = get_etag(current_app.config['SITE_HASH'], rendering.get_content_hash(data))
+		set_validators(response, etag, last_modified)
+
+	page_cache.set(g.page_key, [data, etag, last_modified, time.time(), *g.page_stamps])
+
+	return response
 
 
 # --------------------------------------- #
@@ -165,16 +871,110 @@ class LoginUser(flask_login.UserMixin, database.Model):
 def user_loader(username):
 	return database.session.get(LoginUser, username)
 
+class DatabaseApiKey(database.Model):
+	__tablename__ = 'api_keys'
+
+	id: Mapped[str] = mapped_column(primary_key=True, nullable=False)
+	user_id: Mapped[str] = mapped_column(nullable=False, index=True)
+	created_at: Mapped[float] = mapped_column(nullable=False, default=time.time)
+
+
+# Stand-in for LoginUser on api key requests, so cached keys never need a database session
+class ApiKeyUser(flask_login.UserMixin):
+	def __init__(self, id: str, role: str):
+		self.id = id
+		self.role = role
+
+
+def get_api_key_hash(api_key: str) -> str:
+	return hashlib.sha256(api_key.encode()).hexdigest()
+
+def create_api_key(username: str) -> str:
+	api_key = secrets.token_urlsafe(32)
+
+	database.session.add(DatabaseApiKey(id=get_api_key_hash(api_key), user_id=username))
+	database.session.commit()
+
+	unknown_api_key_cache.clear()
+
+	return api_key
+
+def revoke_api_key(username: str, api_key: str):
+	api_key_hash = get_api_key_hash(api_key)
+
+	database.session.execute(
+		sqlalchemy.delete(DatabaseApiKey).where(DatabaseApiKey.id == api_key_hash, DatabaseApiKey.user_id == username)
+	)
+	database.session.commit()
+
+	api_key_cache.delete(api_key_hash)
+
+
 @login_manager.request_loader
 def request_loader(request):
-	username = request.form.get('username')
-	return database.session.get(LoginUser, username)
+	authorization = request.headers.get('Authorization')
+
+	if not authorization or not authorization.startswith('Bearer '):
+		return None
+
+	api_key_hash = get_api_key_hash(authorization.removeprefix('Bearer '))
+
+	user = api_key_cache.get(api_key_hash)
+	if user is not None:
+		return user
+
+	if unknown_api_key_cache.get(api_key_hash):
+		return None
+
+	api_key = database.session.get(DatabaseApiKey, api_key_hash)
+	login_user = database.session.get(LoginUser, api_key.user_id) if api_key else None
+
+	if login_user is None:
+		unknown_api_key_cache.set(api_key_hash, True)
+		return None
+
+	user = ApiKeyUser(login_user.id, login_user.role)
+	api_key_cache.set(api_key_hash, user)
+
+	return user
 
 @login_manager.unauthorized_handler
 def unauthorized_handler():
 	return abort(401)
 
 
+# Resolved once per request, routes and templates read the result from flask.g
+def resolve_request_user():
+	if request.endpoint == 'static':
+		return
+
+	user = flask_login.current_user
+
+	if user.is_authenticated:
+		g.user = user._get_current_object()
+		g.user_logged_in = True
+		g.user_role = user.role
+	else:
+		g.user = None
+		g.user_logged_in = False
+		g.user_role = 'guest'
+
+	g.user_permissions = config.role_permissions[g.user_role]
+
+def requires_permission(permission: str):
+	def decorator(route):
+		@functools.wraps(route)
+		def wrapper(*args, **kwargs):
+			if permission not in g.user_permissions:
+				abort(403)
+
+			return route(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+
 def register_user(username: str, password: str, role: str):
 	if database.session.get(LoginUser, username):
 		raise FileExistsError(f'\'{username}\' already exists')
@@ -198,25 +998,367 @@ class DatabaseFileStorage(database.Model):
 
 	id: Mapped[str] = mapped_column(primary_key=True, nullable=False)
 	content_link: Mapped[str] = mapped_column(nullable=False)
+	content_hash: Mapped[str] = mapped_column(nullable=False, default='')
+	size: Mapped[int] = mapped_column(nullable=False, default=0)
+
+
+# Multipart headers and boundaries around the uploaded file
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# Receives the uploaded file straight from the multipart parser, hashing and
+# size checking each chunk as it's written to a temporary file in the upload folder
+class UploadStream:
+	def __init__(self, upload_folder: str, max_size: int):
+		file_descriptor, self.path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+		self.file = os.fdopen(file_descriptor, 'w+b')
+
+		self.max_size = max_size
+
+		self.size = 0
+		self.hash = hashlib.sha256()
+
+	def write(self, data: bytes) -> int:
+		self.size += len(data)
+
+		if self.size > self.max_size:
+			raise RequestEntityTooLarge()
+
+		self.hash.update(data)
+		return self.file.write(data)
+
+	def close(self):
+		self.file.close()
+
+		try:
+			os.remove(self.path)
+		except FileNotFoundError:
+			pass
+
+	def __getattr__(self, name: str):
+		return getattr(self.file, name)
+
+class UploadRequest(Request):
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.upload_streams = []
+
+	def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+		if self.endpoint != 'route_api_upload_file':
+			return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+		upload_stream = UploadStream(current_app.config['UPLOAD_FOLDER'], config.role_max_upload_sizes[g.user_role])
+		self.upload_streams.append(upload_stream)
+
+		return upload_stream
+
+	# Also removes temporary files of uploads that were aborted halfway through parsing
+	def close(self):
+		super().close()
+
+		for upload_stream in self.upload_streams:
+			upload_stream.close()
 
 def is_allowed_file(filename: str):
 	return '.' in filename and \
 		filename.rsplit('.', 1)[1].lower() in config.allowed_file_extensions
 
+def get_file_hash(path: str) -> str:
+	with open(path, 'rb') as file:
+		return hashlib.file_digest(file, 'sha256').hexdigest()
+
+
+# Uploads are stored once per unique content, at <upload folder>/ab/cd/abcd...
+class DatabaseBlob(database.Model):
+	__tablename__ = 'blobs'
+
+	id: Mapped[str] = mapped_column(primary_key=True, nullable=False)
+	size: Mapped[int] = mapped_column(nullable=False)
+	reference_count: Mapped[int] = mapped_column(nullable=False, default=0)
+
+def get_blob_link(content_hash: str) -> str:
+	return os.path.join(content_hash[0:2], content_hash[2:4], content_hash)
+
+def is_blob_link(content_link: str) -> bool:
+	return os.sep in content_link
+
+# Links a file into blob storage and counts a reference to it, the caller commits
+def store_blob(server: Flask, source_path: str, content_hash: str, size: int) -> str:
+	content_link = get_blob_link(content_hash)
+	blob_path = os.path.join(server.config['UPLOAD_FOLDER'], content_link)
+
+	os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+
+	try:
+		os.link(source_path, blob_path)
+	except FileExistsError:
+		pass
+
+	database.session.execute(
+		sqlite_insert(DatabaseBlob)
+			.values(id=content_hash, size=size, reference_count=1)
+			.on_conflict_do_update(index_elements=['id'], set_={'reference_count': DatabaseBlob.reference_count + 1})
+	)
+
+	return content_link
+
+def get_file_info(id: str) -> tuple[str, str, str]:
+	file_info = file_cache.get(id)
+	if file_info is not None:
+		return file_info
+
+	file_storage = database.get_or_404(DatabaseFileStorage, id)
+
+	file_info = (
+		file_storage.content_link,
+		file_storage.content_hash,
+		mimetypes.guess_type(file_storage.id)[0] or 'application/octet-stream'
+	)
+	file_cache.set(id, file_info)
+
+	return file_info
+
+def remove_file(id: str):
+	file_info = database.get_or_404(DatabaseFileStorage, id)
+	file_cache.delete(id)
+
+	if is_blob_link(file_info.content_link):
+		database.session.execute(
+			sqlalchemy.update(DatabaseBlob)
+				.where(DatabaseBlob.id == file_info.content_hash)
+				.values(reference_count=DatabaseBlob.reference_count - 1)
+		)
+
+	database.session.delete(file_info)
+	database.session.commit()
+
+# Moves uploads from the old flat layout into blob storage
+def migrate_files(server: Flask) -> int:
+	migrated = 0
+
+	for file_info in DatabaseFileStorage.query.all():
+		if is_blob_link(file_info.content_link):
+			continue
+
+		file_path = os.path.join(server.config['UPLOAD_FOLDER'], file_info.content_link)
+
+		file_info.content_hash = get_file_hash(file_path)
+		file_info.size = os.stat(file_path).st_size
+		file_info.content_link = store_blob(server, file_path, file_info.content_hash, file_info.size)
+
+		database.session.commit()
+
+		os.remove(file_path)
+		migrated += 1
+
+	return migrated
+
+def create_missing_derivatives(server: Flask) -> int:
+	created = 0
+
+	if not config.image_derivatives_enabled:
+		return created
+
+	for file_info in DatabaseFileStorage.query.all():
+		if not derivatives.is_image(file_info.id):
+			continue
+
+		try:
+			created += derivatives.create_derivatives(
+				server.config['UPLOAD_FOLDER'],
+				file_info.content_link,
+				file_info.content_hash,
+				derivatives.get_extension(file_info.id),
+				config
+			)
+		except OSError as exception:
+			logger.notice(f'Could not create derivatives for \'{file_info.id}\': {exception}')
+
+	return created
+
+# Deletes unreferenced blobs, files no blob points to and leftover temporary upload files
+def collect_garbage(server: Flask, temporary_file_age: float = 24 * 60 * 60) -> int:
+	removed = 0
+
+	for blob in DatabaseBlob.query.filter(DatabaseBlob.reference_count <= 0):
+		try:
+			os.remove(os.path.join(server.config['UPLOAD_FOLDER'], get_blob_link(blob.id)))
+		except FileNotFoundError:
+			pass
+
+		database.session.delete(blob)
+		removed += 1
+
+	database.session.commit()
+
+	blob_ids = set(database.session.execute(sqlalchemy.select(DatabaseBlob.id)).scalars())
+	file_links = set(database.session.execute(sqlalchemy.select(DatabaseFileStorage.content_link)).scalars())
+
+	for folder, _, names in os.walk(server.config['UPLOAD_FOLDER']):
+		for name in names:
+			path = os.path.join(folder, name)
+			relative_path = os.path.relpath(path, server.config['UPLOAD_FOLDER'])
+
+			if name.endswith('.part'):
+				if os.stat(path).st_mtime > time.time() - temporary_file_age:
+					continue
+			elif relative_path in file_links or (is_blob_link(relative_path) and name in blob_ids):
+				continue
+			elif relative_path.startswith(derivatives.get_derivatives_folder() + os.sep) and name.split('-', 1)[0] in blob_ids:
+				continue
+
+			os.remove(path)
+			removed += 1
+
+	return removed
+
+
+# --------------------------------------- #
+# Database Upgrades
+# --------------------------------------- #
+# Columns added after a table was first created, create_all() won't add these to existing databases.
+# The first statement is the column definition, the rest run once right after the column is added.
+DATABASE_UPGRADES = {
+	'posts': {
+		'render_version': ['INTEGER NOT NULL DEFAULT 0'],
+		'render_fingerprint': ['VARCHAR NOT NULL DEFAULT \'\''],
+		'content_hash': ['VARCHAR NOT NULL DEFAULT \'\''],
+		'created_at': [
+			'FLOAT NOT NULL DEFAULT 0',
+			'UPDATE posts SET created_at = CAST(strftime(\'%s\', \'now\') AS FLOAT) + rowid * 0.000001',
+			'CREATE INDEX IF NOT EXISTS ix_posts_created_at ON posts (created_at, id)'
+		],
+		'updated_at': [
+			'FLOAT NOT NULL DEFAULT 0',
+			'UPDATE posts SET updated_at = created_at'
+		]
+	},
+	'file_storage': {
+		'content_hash': ['VARCHAR NOT NULL DEFAULT \'\''],
+		'size': ['INTEGER NOT NULL DEFAULT 0']
+	}
+}
+
+def upgrade_database():
+	inspector = sqlalchemy.inspect(database.engine)
+
+	with database.engine.begin() as connection:
+		for table_name, columns in DATABASE_UPGRADES.items():
+			existing_columns = [column['name'] for column in inspector.get_columns(table_name)]
+
+			for column_name, (column_definition, *statements) in columns.items():
+				if column_name in existing_columns:
+					continue
+
+				connection.execute(sqlalchemy.text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}'))
+
+				for statement in statements:
+					connection.execute(sqlalchemy.text(statement))
+
+
+# --------------------------------------- #
+# Database Tuning
+# --------------------------------------- #
+def apply_database_pragmas(dbapi_connection, connection_record):
+	cursor = dbapi_connection.cursor()
+
+	cursor.execute(f'PRAGMA journal_mode = {config.database_journal_mode}')
+	cursor.execute(f'PRAGMA synchronous = {config.database_synchronous}')
+	cursor.execute(f'PRAGMA mmap_size = {int(config.database_mmap_size)}')
+	cursor.execute(f'PRAGMA cache_size = {int(config.database_cache_size)}')
+	cursor.execute(f'PRAGMA busy_timeout = {int(config.database_busy_timeout)}')
+
+	cursor.close()
+
+
+# --------------------------------------- #
+# Secret Keys
+# --------------------------------------- #
+# One key per line, sessions are signed with the first and the others are still accepted
+def get_secret_keys_path(work_path: str) -> str:
+	return config.sessions_secret_keys_path or os.path.join(work_path, 'secret_keys')
+
+def write_secret_keys(path: str, secret_keys: list[str], replace: bool = True):
+	if os.path.dirname(path):
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+
+	# Without replace, only the first of several starting workers gets to create the file
+	try:
+		with atomic_path(path, replace) as temporary_path:
+			with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+				file.write('\n'.join(secret_keys) + '\n')
+	except FileExistsError:
+		pass
+
+def load_secret_keys(path: str) -> list[str]:
+	if not os.path.exists(path):
+		write_secret_keys(path, [secrets.token_hex(32)], replace=False)
+
+	with open(path, 'r') as file:
+		secret_keys = [line.strip() for line in file if line.strip()]
+
+	if not secret_keys:
+		logger.error(f'No secret keys in \'{path}\'')
+
+	return secret_keys
+
+def rotate_secret_keys(path: str) -> list[str]:
+	secret_keys = [secrets.token_hex(32), *load_secret_keys(path)][0:config.sessions_old_secret_keys + 1]
+	write_secret_keys(path, secret_keys)
+
+	return secret_keys
+
 
 # --------------------------------------- #
 # Server
 # --------------------------------------- #
 def create_server(work_path: str) -> Flask:
 	server = Flask(__name__, static_folder=os.path.join(work_path, 'src/static'), static_url_path='/static', template_folder='src/templates')
+	server.request_class = UploadRequest
 
-	server.secret_key = secrets.token_hex(16)
+	secret_keys = load_secret_keys(get_secret_keys_path(work_path))
+
+	server.secret_key = secret_keys[0]
+	server.config['SECRET_KEY_FALLBACKS'] = secret_keys[1:]
 	server.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(work_path, 'main.db')
-	server.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+	server.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+	server.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+		'pool_size': config.database_pool_size,
+		'max_overflow': config.database_max_overflow,
+		'pool_timeout': config.database_pool_timeout,
+		'connect_args': {
+			'timeout': config.database_busy_timeout / 1000,
+			'check_same_thread': False
+		}
+	}
 	server.config['POSTS_FOLDER'] = os.path.join(work_path, 'posts')
 	server.config['UPLOAD_FOLDER'] = os.path.join(work_path, 'uploads')
+	server.config['MAX_CONTENT_LENGTH'] = max(config.role_max_upload_sizes.values()) + UPLOAD_FORM_OVERHEAD
+	server.config['USE_X_SENDFILE'] = config.file_storage_offload == 'x-sendfile'
+
+	server.config['PAGES_FOLDER'] = os.path.join(work_path, 'pages')
+	server.config['COPYRIGHT_PATH'] = os.path.join(server.root_path, 'COPYRIGHT.md')
+
+	server.config['CACHE_FOLDER'] = os.path.join(work_path, 'cache')
+	server.config['PAGE_STAMPS_FOLDER'] = os.path.join(server.config['CACHE_FOLDER'], 'page_stamps')
+
+	server.config['SITE_HASH'] = rendering.get_site_hash(os.path.join(server.root_path, server.template_folder), CONFIG_PATH)
 
 	os.makedirs(server.config['POSTS_FOLDER'], exist_ok=True)
+	os.makedirs(server.config['PAGES_FOLDER'], exist_ok=True)
+
+	# Rendered now so the first visitors don't have to wait for it
+	markdown_pages.get(server.config['COPYRIGHT_PATH'])
+
+	for name in rendering.get_page_names(server.config['PAGES_FOLDER']):
+		markdown_pages.get(os.path.join(server.config['PAGES_FOLDER'], name + '.md'))
+
+	if config.post_cache_persist:
+		post_cache.set_persist_folder(os.path.join(server.config['CACHE_FOLDER'], 'posts'))
+
+	os.makedirs(server.config['PAGE_STAMPS_FOLDER'], exist_ok=True)
+
+	if config.page_cache_persist:
+		page_cache.set_persist_folder(os.path.join(server.config['CACHE_FOLDER'], 'pages'))
 
 	try:
 		os.mkdir(server.config['UPLOAD_FOLDER'])
@@ -226,9 +1368,32 @@ def create_server(work_path: str) -> Flask:
 	database.init_app(server)
 	login_manager.init_app(server)
 
+	rendering.set_template_cache(server.jinja_env, os.path.join(server.config['CACHE_FOLDER'], 'templates'))
+	rendering.load_templates(server.jinja_env)
+
+	server.config['STYLESHEET'] = rendering.render_stylesheet(server.jinja_env, config)
+	server.config['STYLESHEET_NAME'] = rendering.get_stylesheet_name(server.config['STYLESHEET'])
+
+	server.jinja_env.globals['stylesheetName'] = server.config['STYLESHEET_NAME']
+
+	server.before_request(resolve_request_user)
+	server.before_request(serve_cached_page)
+
+	# after_request hooks run last to first, so pages are cached before they are compressed
+	server.after_request(compress_response)
+	server.after_request(cache_page)
+
 
 	with server.app_context():
+		sqlalchemy.event.listen(database.engine, 'connect', apply_database_pragmas)
+
 		database.create_all()
+		upgrade_database()
+		create_search_index(server)
+
+		# Fills SQLAlchemy's statement cache, so the first requests for posts don't have to compile these
+		get_posts_page()
+		database.session.get(DatabasePost, '')
 
 
 	# --------------------------------------- #
@@ -253,17 +1418,8 @@ def create_server(work_path: str) -> Flask:
 		return Response(status=200)
 
 	@server.route('/api/v0/posts/create', methods=['POST'])
+	@requires_permission('CAN_WRITE_POSTS')
 	def route_api_create_post():
-		try:
-			user_role = config.roles[flask_login.current_user.role]
-		except AttributeError:
-			user_role = config.roles['guest']
-
-		user_permissions = user_role['permissions']
-
-		if 'CAN_WRITE_POSTS' not in user_permissions:
-			abort(403)
-
 		request_json = request.get_json()
 
 		try:
@@ -273,9 +1429,9 @@ def create_server(work_path: str) -> Flask:
 		except KeyError:
 			return abort(400)
 
-		try:
-			author = flask_login.current_user.id
-		except AttributeError:
+		if g.user_logged_in:
+			author = g.user.id
+		else:
 			author = '(no author)'
 
 		try:
@@ -285,29 +1441,129 @@ def create_server(work_path: str) -> Flask:
 
 		return Response(status=200)
 
+	@server.route('/api/v0/posts')
+	def route_api_get_posts():
+		fields = request.args.get('fields', ','.join(DEFAULT_POST_FIELDS)).split(',')
+
+		if not POST_FIELDS.issuperset(fields):
+			abort(400)
+
+		ndjson = request.args.get('format') == 'ndjson' \
+			or request.accept_mimetypes.best_match(('application/json', 'application/x-ndjson')) == 'application/x-ndjson'
+
+		# NDJSON streams every post unless limited, the JSON object keeps its old page size.
+		# Parsed here instead of with type=, which would ignore a bad filter and list every post.
+		try:
+			limit = int(request.args['limit']) if 'limit' in request.args else (None if ndjson else config.posts_per_page)
+			since = float(request.args['since']) if 'since' in request.args else None
+		except ValueError:
+			abort(400)
+
+		if (limit is not None and limit < 1) or (since is not None and not math.isfinite(since)):
+			abort(400)
+
+		pages = iterate_posts_pages(request.args.get('after'), since, limit)
+
+		# Fetched before the response starts, so a bad cursor is still a 400
+		pages = itertools.chain([next(pages)], pages)
+
+		# One post per line, followed by {"next": cursor} if limit stopped the listing early
+		def generate_ndjson():
+			next_cursor = None
+
+			for posts, next_cursor in pages:
+				for post_info in posts:
+					yield json.dumps(get_post_fields(server, post_info, fields)) + '\n'
+
+			if next_cursor:
+				yield json.dumps({'next': next_cursor}) + '\n'
+
+		# {"posts": [...], "next": cursor}, written one post at a time
+		def generate_json():
+			yield '{"posts":['
+
+			next_cursor = None
+			separator = ''
+
+			for posts, next_cursor in pages:
+				for post_info in posts:
+					yield separator + json.dumps(get_post_fields(server, post_info, fields))
+					separator = ','
+
+			yield '],"next":' + json.dumps(next_cursor) + '}'
+
+		if ndjson:
+			return get_streamed_response(generate_ndjson(), 'application/x-ndjson')
+
+		return get_streamed_response(generate_json(), 'application/json')
+
+	@server.route('/api/v0/posts/import', methods=['POST'])
+	@requires_permission('CAN_WRITE_POSTS')
+	def route_api_import_posts():
+		request.max_content_length = config.post_import_max_size
+
+		match request.mimetype:
+			case 'application/x-ndjson':
+				posts = read_ndjson_posts(request.stream)
+			case 'application/x-tar' | 'application/gzip' | 'application/x-gzip':
+				posts = read_tar_posts(request.stream)
+			case _:
+				abort(415)
+
+		# Archives keep their authors, posts without one are attributed to the importing user
+		author = g.user.id if g.user_logged_in else None
+
+		# Progress is streamed back as one json object per batch
+		def generate():
+			try:
+				for progress in import_posts(server, posts, author):
+					yield json.dumps(progress) + '\n'
+			except (ValueError, UnicodeDecodeError, tarfile.TarError) as exception:
+				yield json.dumps({'error': str(exception)}) + '\n'
+
+		return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+	@server.route('/api/v0/posts/search')
+	def route_api_search_posts():
+		page = max(1, request.args.get('page', 1, type=int))
+		results, next_page = search_posts(request.args.get('q', ''), page)
+
+		return jsonify({
+			'posts': [
+				{
+					'id': post_info.id,
+					'title': post_info.title,
+					'author': post_info.author,
+					'description': post_info.description,
+					'like_count': post_info.like_count,
+					# Html like the post content, the snippet is plain text from the search index
+					'snippet': str(escape(snippet))
+				}
+				for post_info, snippet in results
+			],
+			'page': page,
+			'next': next_page
+		})
+
 	@server.route('/api/v0/posts/<id>')
 	def route_api_get_post(id):
 		post_info, post_content = get_post(server, id)
 
-		return jsonify({
+		etag = get_etag(post_info.content_hash, post_info.title, post_info.author, post_info.description)
+
+		if not is_modified(etag):
+			return set_validators(server.response_class(status=304), etag, post_info.updated_at)
+
+		return set_validators(jsonify({
 			'title': post_info.title,
 			'author': post_info.author,
 			'description': post_info.description,
 			'content': post_content
-		})
+		}), etag, post_info.updated_at)
 
 	@server.route('/api/v0/posts/<id>/like')
+	@requires_permission('CAN_LIKE')
 	def route_api_like_post(id):
-		try:
-			user_role = config.roles[flask_login.current_user.role]
-		except AttributeError:
-			user_role = config.roles['guest']
-
-		user_permissions = user_role['permissions']
-
-		if 'CAN_LIKE' not in user_permissions:
-			abort(403)
-
 		likes = like_post(id)
 
 		return jsonify({
@@ -320,28 +1576,14 @@ def create_server(work_path: str) -> Flask:
 	# --------------------------------------- #
 	@server.route('/main.css')
 	def route_main_css():
-		stylesheet = render_template(
-			'main.css',
-
-			colorBackground = config.site_color_background,
-			colorBackgroundAccent = config.site_color_background_accent,
-
-			colorText = config.site_color_text,
-			colorTextLight = config.site_color_text_light,
-
-			colorAccent = config.site_color_accent,
-			colorAccentHover = config.site_color_accent_hover,
-
-			colorAccentText = config.site_color_accent_text,
-
-			colorCode = config.site_color_code,
+		return Response(server.config['STYLESHEET'], status=200, headers={'Content-Type': 'text/css', 'Cache-Control': 'max-age=3600'})
 
-			colorPreformatted = config.site_color_preformatted,
+	@server.route('/main.<stylesheet_hash>.css')
+	def route_hashed_main_css(stylesheet_hash):
+		if f'main.{stylesheet_hash}.css' != server.config['STYLESHEET_NAME']:
+			return redirect('/' + server.config['STYLESHEET_NAME'])
 
-			colorDisabled = config.site_color_disabled
-		)
-
-		return Response(stylesheet, status=200, headers={'Content-Type': 'text/css', 'Cache-Control': 'max-age=250000'})
+		return Response(server.config['STYLESHEET'], status=200, headers={'Content-Type': 'text/css', 'Cache-Control': 'public, max-age=31536000, immutable'})
 
 	@server.route('/startup')
 	def route_startup():
@@ -352,52 +1594,28 @@ def create_server(work_path: str) -> Flask:
 
 	@server.route('/')
 	def route_homepage():
-		try:
-			user_id = flask_login.current_user.id
-			user_role = config.roles[flask_login.current_user.role]
-			user_logged_in = True
-		except AttributeError:
-			user_role = config.roles['guest']
-			user_logged_in = False
-
-		user_permissions = user_role['permissions']
+		posts, _ = get_posts_page(limit=3)
 
-		posts = DatabasePost.query.all()
-		posts.reverse()
-		posts = posts[0:3]
-
-		return render_template('homepage.html', siteName=config.site_name, user=user_logged_in, recentPosts=posts, permissions=user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
+		return render_template('homepage.html', siteName=config.site_name, user=g.user_logged_in, recentPosts=posts, permissions=g.user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
 
 	@server.route('/posts/create')
 	def route_create_post():
-		try:
-			user_id = flask_login.current_user.id
-			user_role = config.roles[flask_login.current_user.role]
-			user_logged_in = True
-		except AttributeError:
-			user_role = config.roles['guest']
-			user_logged_in = False
-
-		user_permissions = user_role['permissions']
-
-		return render_template('create_post.html', siteName=config.site_name, user=True, permissions=user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
+		return render_template('create_post.html', siteName=config.site_name, user=True, permissions=g.user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
 
 	@server.route('/posts/')
 	def route_get_posts():
-		try:
-			user_id = flask_login.current_user.id
-			user_role = config.roles[flask_login.current_user.role]
-			user_logged_in = True
-		except AttributeError:
-			user_role = config.roles['guest']
-			user_logged_in = False
+		posts, next_cursor = get_posts_page(request.args.get('after'))
 
-		user_permissions = user_role['permissions']
+		return render_template('posts.html', siteName=config.site_name, user=g.user_logged_in, posts=posts, nextCursor=next_cursor, permissions=g.user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
 
-		posts = DatabasePost.query.all()
-		posts.reverse()
+	@server.route('/posts/search')
+	def route_search_posts():
+		query = request.args.get('q', '')
+		page = max(1, request.args.get('page', 1, type=int))
 
-		return render_template('posts.html', siteName=config.site_name, user=user_logged_in, posts=posts, permissions=user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
+		results, next_page = search_posts(query, page)
+
+		return render_template('search.html', siteName=config.site_name, user=g.user_logged_in, query=query, results=results, nextPage=next_page, permissions=g.user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
 
 	@server.route('/posts/<id>')
 	def route_get_post(id):
@@ -406,32 +1624,35 @@ def create_server(work_path: str) -> Flask:
 
 	@server.route('/copyright')
 	def route_copyright():
-		with open('COPYRIGHT.md', 'r') as copyright_file:
-			copyright = markdown(copyright_file.read())
-
-		return stream_template('post.html',
+		return render_template('page.html',
 		siteName = config.site_name,
 		pageName = 'Copyright',
-		content = copyright,
+		content = markdown_pages.get(server.config['COPYRIGHT_PATH']),
+		permissions=g.user_permissions,
 		footnote = config.footnote,
 		linkBadges=config.link_badges)
 
+	@server.route('/pages/<name>')
+	def route_get_page(name):
+		path = safe_join(server.config['PAGES_FOLDER'], name + '.md')
+
+		if path is None:
+			abort(404)
+
+		try:
+			content = markdown_pages.get(path)
+		except FileNotFoundError:
+			abort(404)
+
+		return render_template('page.html', siteName=config.site_name, pageName=rendering.get_page_title(name), content=content, user=g.user_logged_in, permissions=g.user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
+
 
 	# --------------------------------------- #
 	# API User Routes
 	# --------------------------------------- #
 	@server.route('/api/v0/users/register', methods=['POST'])
+	@requires_permission('CAN_REGISTER')
 	def route_api_user_register():
-		try:
-			user_role = config.roles[flask_login.current_user.role]
-		except AttributeError:
-			user_role = config.roles['guest']
-		
-		user_permissions = user_role['permissions']
-
-		if 'CAN_REGISTER' not in user_permissions:
-			abort(403)
-
 		try:
 			json_data = request.get_json()
 			username = json_data['username']
@@ -448,17 +1669,8 @@ def create_server(work_path: str) -> Flask:
 
 
 	@server.route('/api/v0/users/login', methods=['POST'])
+	@requires_permission('CAN_LOGIN')
 	def route_api_user_login():
-		try:
-			user_role = config.roles[flask_login.current_user.role]
-		except AttributeError:
-			user_role = config.roles['guest']
-		
-		user_permissions = user_role['permissions']
-
-		if 'CAN_LOGIN' not in user_permissions:
-			abort(403)
-
 		try:
 			json_data = request.get_json()
 			username = json_data['username']
@@ -473,18 +1685,34 @@ def create_server(work_path: str) -> Flask:
 		flask_login.login_user(user_info)
 		return Response(status=200)
 
-	@server.route('/api/v0/users/logout', methods=['POST'])
-	def route_api_user_logout():
+	@server.route('/api/v0/users/api_keys', methods=['POST'])
+	@requires_permission('CAN_CREATE_API_KEYS')
+	def route_api_user_create_api_key():
+		if not g.user_logged_in:
+			abort(401)
+
+		return jsonify({
+			'key': create_api_key(g.user.id)
+		})
+
+	@server.route('/api/v0/users/api_keys/revoke', methods=['POST'])
+	@requires_permission('CAN_CREATE_API_KEYS')
+	def route_api_user_revoke_api_key():
+		if not g.user_logged_in:
+			abort(401)
+
 		try:
-			user_role = config.roles[flask_login.current_user.role]
-		except AttributeError:
-			user_role = config.roles['guest']
-		
-		user_permissions = user_role['permissions']
+			api_key = request.get_json()['key']
+		except KeyError:
+			abort(400)
 
-		if 'CAN_LOGOUT' not in user_permissions:
-			abort(403)
+		revoke_api_key(g.user.id, api_key)
+
+		return Response(status=200)
 
+	@server.route('/api/v0/users/logout', methods=['POST'])
+	@requires_permission('CAN_LOGOUT')
+	def route_api_user_logout():
 		flask_login.logout_user()
 		return Response(status=200)
 
@@ -494,62 +1722,26 @@ def create_server(work_path: str) -> Flask:
 	# --------------------------------------- #
 	@server.route('/users/register')
 	def route_user_register():
-		try:
-			user_id = flask_login.current_user.id
-			user_role = config.roles[flask_login.current_user.role]
-			user_logged_in = True
-		except AttributeError:
-			user_role = config.roles['guest']
-			user_logged_in = False
-
-		user_permissions = user_role['permissions']
-
-		return render_template('users/register.html', siteName=config.site_name, permissions=user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
+		return render_template('users/register.html', siteName=config.site_name, permissions=g.user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
 
 
 	@server.route('/users/login')
 	def route_user_login():
-		try:
-			user_id = flask_login.current_user.id
-			user_role = config.roles[flask_login.current_user.role]
-			user_logged_in = True
-		except AttributeError:
-			user_role = config.roles['guest']
-			user_logged_in = False
-
-		user_permissions = user_role['permissions']
-
-		return render_template('users/login.html', siteName=config.site_name, permissions=user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
+		return render_template('users/login.html', siteName=config.site_name, permissions=g.user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
 
 	@server.route('/users/logout')
 	def route_user_logout():
-		try:
-			user_id = flask_login.current_user.id
-			user_role = config.roles[flask_login.current_user.role]
-			user_logged_in = True
-		except AttributeError:
-			user_role = config.roles['guest']
-			user_logged_in = False
-
-		user_permissions = user_role['permissions']
-
-		return render_template('users/logout.html', siteName=config.site_name, user=True, permissions=user_permissions, footnote=config.footnote)
+		return render_template('users/logout.html', siteName=config.site_name, user=True, permissions=g.user_permissions, footnote=config.footnote)
 
 	# --------------------------------------- #
 	# API File Storage Routes
 	# --------------------------------------- #
 	@server.route('/api/v0/file_storage/upload', methods=['POST'])
+	@requires_permission('CAN_UPLOAD_FILES')
 	def route_api_upload_file():
-		try:
-			user_role = config.roles[flask_login.current_user.role]
-		except AttributeError:
-			user_role = config.roles['guest']
-
-		user_permissions = user_role['permissions']
-
-		if 'CAN_UPLOAD_FILES' not in user_permissions:
-			abort(403)
-
+		if request.content_length is not None \
+			and request.content_length > config.role_max_upload_sizes[g.user_role] + UPLOAD_FORM_OVERHEAD:
+			abort(413)
 
 		if 'file' not in request.files:
 			abort(400)
@@ -562,21 +1754,33 @@ def create_server(work_path: str) -> Flask:
 			abort(400)
 		if not is_allowed_file(file.filename):
 			abort(400)
+		if not isinstance(file.stream, UploadStream):
+			abort(400)
 
 		filename = secure_filename(file.filename)
 
-		if filename in os.listdir(server.config['UPLOAD_FOLDER']):
+		if database.session.get(DatabaseFileStorage, filename):
 			abort(409)
 
-		file.save(os.path.join(server.config['UPLOAD_FOLDER'], filename))
+		file.stream.file.flush()
+		content_hash = file.stream.hash.hexdigest()
 
 		file_storage = DatabaseFileStorage(
 			id = filename,
-			content_link = filename
+			content_link = store_blob(server, file.stream.path, content_hash, file.stream.size),
+			content_hash = content_hash,
+			size = file.stream.size
 		)
 
 		database.session.add(file_storage)
-		database.session.commit()
+
+		try:
+			database.session.commit()
+		except sqlalchemy.exc.IntegrityError:
+			database.session.rollback()
+			abort(409)
+
+		derivative_generator.submit(server.config['UPLOAD_FOLDER'], file_storage.content_link, content_hash, filename)
 
 		return jsonify({
 			'location': filename
@@ -587,22 +1791,49 @@ def create_server(work_path: str) -> Flask:
 	# --------------------------------------- #
 	@server.route('/file_storage/upload')
 	def route_upload_file():
-		try:
-			user_id = flask_login.current_user.id
-			user_role = config.roles[flask_login.current_user.role]
-			user_logged_in = True
-		except AttributeError:
-			user_role = config.roles['guest']
-			user_logged_in = False
-
-		user_permissions = user_role['permissions']
-
-		return render_template('file_upload.html', siteName=config.site_name, user=True, permissions=user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
+		return render_template('file_upload.html', siteName=config.site_name, user=True, permissions=g.user_permissions, footnote=config.footnote, linkBadges=config.link_badges)
 
 	@server.route('/file_storage/<file>')
 	def route_get_file(file):
-		file_info = database.get_or_404(DatabaseFileStorage, file)
-		return send_from_directory(server.config['UPLOAD_FOLDER'], file_info.content_link)
+		content_link, content_hash, mimetype = get_file_info(file)
+
+		requested_width = request.args.get('w', type=int)
+
+		if requested_width and config.image_derivatives_enabled and derivatives.is_image(file):
+			width = derivatives.get_derivative_width(requested_width, config)
+
+			if width is not None:
+				derivative_link = derivatives.get_derivative_link(content_hash, width, derivatives.get_extension(file))
+
+				# Falls back to the original until the derivative has been generated
+				if os.path.exists(os.path.join(server.config['UPLOAD_FOLDER'], derivative_link)):
+					content_link = derivative_link
+					content_hash = f'{content_hash}-{width}'
+
+		# Let the front proxy send the bytes, it maps the prefix to an internal location for the upload folder
+		if config.file_storage_offload == 'x-accel-redirect':
+			response = Response(mimetype=mimetype, headers={
+				'X-Accel-Redirect': config.file_storage_offload_prefix + content_link.replace(os.sep, '/')
+			})
+			response.set_etag(content_hash)
+
+			return response
+
+		# Handles Range and conditional requests, the body goes out through wsgi.file_wrapper
+		# (sendfile on servers that support it) or as an X-Sendfile header with USE_X_SENDFILE
+		return send_from_directory(
+			server.config['UPLOAD_FOLDER'],
+			content_link,
+			mimetype=mimetype,
+			etag=content_hash or True,
+			conditional=True
+		)
+
+	@server.route('/api/v0/file_storage/<file>/delete', methods=['POST'])
+	@requires_permission('CAN_DELETE_FILES')
+	def route_api_delete_file(file):
+		remove_file(file)
+		return Response(status=200)
 
 
 	return server